@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+收集和 Kconfig 流程的基准测试
+
+在 synthetic.py 生成的 XF_ROOT 上统计各阶段在不同组件数量下的耗时：
+Project.program、MenuConfig 的构造、MenuConfig.scan_kconfig 以及
+api.apply_components_template。每次测量都启动新的进程：
+cold 为清空 build 文件夹后执行的耗时，warm 为保留 build 文件夹、在新进程中重复执行的中位数，
+inprocess 为 cold 进程中再次执行的中位数，反映进程内缓存（watch 模式、常驻进程）的效果。
+
+    python benchmarks/pipeline.py --json result.json
+    python benchmarks/pipeline.py -s 10 -s 100 --baseline result.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import generate, TARGET, VENDOR  # noqa: E402
+
+DEFAULT_SCALES = [10, 100, 1000]
+PHASES = ["scan_kconfig", "menuconfig", "program", "template"]
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    进程中第一次执行的耗时，以及之后在同一进程中重复执行的中位数，单位毫秒
+    """
+    start = time.perf_counter()
+    func()
+    first = (time.perf_counter() - start) * 1000
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"first_ms": first,
+            "inprocess_ms": statistics.median(times) if times else None}
+
+
+def worker(phase: str, repeat: int) -> dict:
+    """
+    在子进程中执行一个阶段，xf_build 根据环境变量确定 XF_ROOT 和工程
+    """
+    import xf_build
+    from xf_build import api
+    from xf_build.build import Project
+    from xf_build.env import get_context
+    from xf_build.indexer import SourceIndex, source_index
+    from xf_build.menuconfig import MenuConfig
+
+    ctx = get_context()
+
+    def program():
+        xf_build.bind_project(Project(ctx=ctx))
+        xf_build.program()
+
+    def scan_kconfig():
+        source_index.load(ctx.PROJECT_BUILD_PATH / SourceIndex.INDEX_NAME)
+        MenuConfig.scan_kconfig(ctx, build_info)
+
+    if phase == "program":
+        return measure(program, repeat)
+
+    build_info = Project(ctx=ctx).discover()
+    if phase == "scan_kconfig":
+        return measure(scan_kconfig, repeat)
+    if phase == "menuconfig":
+        scan_kconfig()
+        return measure(lambda: MenuConfig.from_context(ctx), repeat)
+    if phase == "template":
+        program()
+        return measure(lambda: api.apply_components_template(
+            "component.j2", ".cmake"), repeat)
+    raise ValueError(f"unknown phase: {phase}")
+
+
+def run_worker(project: Path, env: dict, phase: str, repeat: int) -> dict:
+    """
+    启动新的进程执行一个阶段
+    """
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                           "--worker", phase, "-n", str(repeat)],
+                          cwd=project, env=env, stdout=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{phase} failed with code {proc.returncode}")
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def run_phase(root: Path, project: Path, phase: str, repeat: int) -> dict:
+    """
+    测量一个阶段的 cold、warm 和 inprocess 耗时
+
+    :param repeat: warm 启动新进程的次数，也是 cold 进程中重复执行的次数
+    """
+    shutil.rmtree(root / "build", ignore_errors=True)
+    shutil.rmtree(project / "build", ignore_errors=True)
+    env = dict(os.environ, XF_ROOT=root.as_posix(), XF_TARGET=TARGET,
+               XF_TARGET_PATH=(root / "boards" / VENDOR / TARGET).as_posix(),
+               XF_NO_DAEMON="1")
+    env.pop("XF_PROJECT_PATH", None)
+    env.pop("XF_PROJECT", None)
+    env.pop("XF_BUILD_JOBS", None)
+    cold = run_worker(project, env, phase, repeat)
+    # build 文件夹中已经有各种缓存，每次都是新的进程，没有进程内的缓存
+    warm = [run_worker(project, env, phase, 0)["first_ms"]
+            for _ in range(repeat)]
+    return {"cold_ms": cold["first_ms"],
+            "warm_ms": statistics.median(warm) if warm else cold["first_ms"],
+            "inprocess_ms": cold["inprocess_ms"] or cold["first_ms"]}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    与基准结果对比，打印每一项的比值
+
+    :return: 是否有阶段变慢超过 threshold
+    """
+    regressed = False
+    print("\ncompared with baseline (current / baseline):")
+    for scale, phases in results["scales"].items():
+        for phase, result in phases.items():
+            old = baseline.get("scales", {}).get(scale, {}).get(phase)
+            if old is None:
+                continue
+            for key in ("cold_ms", "warm_ms", "inprocess_ms"):
+                if key not in old:
+                    continue
+                ratio = result[key] / old[key] if old[key] else 1.0
+                flag = ""
+                if ratio > threshold:
+                    flag = "  <-- regression"
+                    regressed = True
+                print(f"    {scale:>5} {phase:<13} {key[:-3]:<9} "
+                      f"{old[key]:9.1f} -> {result[key]:9.1f} ms "
+                      f"x{ratio:.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="收集和 Kconfig 流程的基准测试")
+    parser.add_argument("-s", "--scale", type=int, action="append",
+                        help="组件数量，可以多次指定，默认为 10、100、1000")
+    parser.add_argument("-m", "--sources", type=int, default=4,
+                        help="每个组件的源文件数量")
+    parser.add_argument("-k", "--symbols", type=int, default=4,
+                        help="每个组件 XFKconfig 中的宏数量")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="warm 启动新进程的次数，以及进程内重复执行的次数")
+    parser.add_argument("-p", "--phase", action="append", choices=PHASES,
+                        help="只测试指定的阶段，可以多次指定")
+    parser.add_argument("--root", type=str, default=None,
+                        help="生成 XF_ROOT 的文件夹，默认为临时文件夹")
+    parser.add_argument("--json", type=str, default=None,
+                        help="结果保存成json")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="与之前保存的json对比")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="比基准慢多少倍视为退化，存在退化时返回 1")
+    parser.add_argument("--worker", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.repeat)))
+        return
+
+    results = {
+        "python": sys.version.split()[0],
+        "sources": args.sources,
+        "symbols": args.symbols,
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    workdir = Path(args.root or tempfile.mkdtemp(prefix="xf_bench_"))
+    try:
+        for scale in args.scale or DEFAULT_SCALES:
+            root = workdir / f"root_{scale}"
+            project = generate(root, scale, args.sources, args.symbols)
+            phases = {}
+            print(f"\n{scale} components:")
+            for phase in args.phase or PHASES:
+                phases[phase] = run_phase(root, project, phase, args.repeat)
+                print(f"    {phase:<13} cold {phases[phase]['cold_ms']:9.1f} ms"
+                      f"    warm {phases[phase]['warm_ms']:9.1f} ms"
+                      f"    inprocess {phases[phase]['inprocess_ms']:9.1f} ms")
+            results["scales"][str(scale)] = phases
+    finally:
+        if args.root is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
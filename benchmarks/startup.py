@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+xf 命令启动时间的基准测试
+
+对每个子命令统计多次执行的耗时，并通过 python -X importtime 列出导入耗时最多的模块。
+需要先调用 export 脚本设置 XF_ROOT 等环境变量，并在一个工程目录下执行
+（clean 会删除工程的 build 文件夹）：
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py -n 20 --json startup.json -c "-t clean" -c "target -s"
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_COMMANDS = ["--help", "-t clean", "target -s"]
+
+# 与 xf 命令的入口一致，但不经过 console script 的包装
+ENTRY = "import sys; sys.argv[0] = 'xf'; from xf_build.daemon import main; main()"
+
+IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def run(args: list, importtime: bool = False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", ENTRY] + args
+    env = dict(os.environ, XF_NO_DAEMON="1")
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, env=env,
+                          universal_newlines=True)
+    return time.perf_counter() - start, proc.returncode, proc.stderr
+
+
+def top_imports(stderr: str, count: int) -> list:
+    """
+    解析 -X importtime 的输出，按顶层包汇总导入耗时（自身耗时之和）
+    """
+    result = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match is None:
+            continue
+        own, _, _, name = match.groups()
+        package = name.split(".")[0]
+        result[package] = result.get(package, 0) + int(own) / 1000
+    result = sorted(result.items(), key=lambda i: i[1], reverse=True)
+    return result[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="xf 命令启动时间基准测试")
+    parser.add_argument("-c", "--command", action="append",
+                        help="需要测试的子命令，可以多次指定")
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="每个命令执行的次数")
+    parser.add_argument("--top", type=int, default=8,
+                        help="列出导入耗时最多的模块数量")
+    parser.add_argument("--json", type=str, default=None,
+                        help="结果保存成json")
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "interpreter_ms": statistics.median(
+            run_interpreter() for _ in range(args.repeat)) * 1000,
+        "commands": {},
+    }
+    print(f"python startup: {results['interpreter_ms']:.1f} ms")
+
+    for command in args.command or DEFAULT_COMMANDS:
+        argv = command.split()
+        times = []
+        code = 0
+        for _ in range(args.repeat):
+            elapsed, code, _ = run(argv)
+            times.append(elapsed * 1000)
+        _, _, stderr = run(argv, importtime=True)
+        imports = top_imports(stderr, args.top)
+        results["commands"][command] = {
+            "returncode": code,
+            "median_ms": statistics.median(times),
+            "min_ms": min(times),
+            "max_ms": max(times),
+            "imports_ms": dict(imports),
+        }
+        print(f"\nxf {command}: median {statistics.median(times):.1f} ms, "
+              f"min {min(times):.1f} ms, returncode {code}")
+        for name, ms in imports:
+            print(f"    {ms:8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+def run_interpreter() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+生成用于基准测试的 XF_ROOT
+
+包括 boards、ports、只有空实现的插件、N 个公共组件以及一个工程。
+每个组件有 M 个源文件（部分位于多层文件夹中）、带 K 个宏的 XFKconfig，
+收集脚本中调用 get_define 并依赖前一个组件：
+
+    python benchmarks/synthetic.py /tmp/xf_bench -n 100 -m 8 -k 4
+    . /tmp/xf_bench/export.sh
+"""
+
+import shutil
+import argparse
+from pathlib import Path
+
+TARGET = "bench"
+VENDOR = "vendor"
+
+EXPORT_SCRIPT = """\
+export XF_ROOT={root}
+export XF_TARGET={target}
+export XF_TARGET_PATH={root}/boards/{vendor}/{target}
+"""
+
+ROOT_KCONFIG = """\
+config BENCH_ROOT
+    bool "bench root"
+    default y
+"""
+
+BOARDS_KCONFIG = """\
+config BENCH_BOARD
+    int "bench board"
+    default 1
+"""
+
+PLUGIN_INIT = "from .{target} import {target}\n"
+
+PLUGIN = """\
+class {target}:
+    def build(self, args):
+        pass
+
+    def clean(self, args):
+        pass
+
+    def menuconfig(self, args):
+        pass
+"""
+
+TEMPLATE = """\
+# {{ path }}
+{% for src in srcs %}{{ src }}
+{% endfor %}{% for inc in inc_dirs %}-I{{ inc }}
+{% endfor %}{{ cflags | join(" ") }}
+"""
+
+PROJECT_SCRIPT = """\
+import xf_build
+xf_build.project_init()
+xf_build.program()
+"""
+
+COLLECT_SCRIPT = """\
+import xf_build
+enable = xf_build.get_define("{prefix}_EN")
+level = xf_build.get_define("{prefix}_LEVEL")
+xf_build.collect(srcs=["*.c", "src/**/*.c"], inc_dirs=["include"],
+                 requires={requires},
+                 cflags=["-D{prefix}_LEVEL=" + str(level)])
+"""
+
+
+def component_kconfig(prefix: str, name: str, symbols: int) -> str:
+    lines = [
+        f'menu "{name}"',
+        f"config {prefix}_EN",
+        f'    bool "enable {name}"',
+        "    default y",
+        f"config {prefix}_LEVEL",
+        f'    int "{name} level"',
+        f"    depends on {prefix}_EN",
+        "    default 1",
+    ]
+    for i in range(max(symbols - 2, 0)):
+        lines += [
+            f"config {prefix}_OPT{i}",
+            f'    bool "{name} option {i}"',
+            f"    depends on {prefix}_EN",
+            f"    default {'y' if i % 2 == 0 else 'n'}",
+        ]
+    lines.append("endmenu")
+    return "\n".join(lines) + "\n"
+
+
+def write_component(path: Path, index: int, sources: int,
+                    symbols: int) -> None:
+    name = f"comp{index}"
+    prefix = name.upper()
+    requires = [f"comp{index - 1}"] if index % 10 else []
+    (path / "include").mkdir(parents=True)
+    (path / "include" / f"{name}.h").write_text(
+        f'#include "xfconfig.h"\nint {name}_init(void);\n')
+    (path / f"{name}.c").write_text(
+        f'#include "{name}.h"\nint {name}_init(void) {{ return 0; }}\n')
+    # 其余源文件分布在两层文件夹中，覆盖 ** 的递归查找
+    for i in range(1, sources):
+        src = path / "src" / f"d{i % 3}" / f"s{i % 2}"
+        src.mkdir(parents=True, exist_ok=True)
+        (src / f"{name}_{i}.c").write_text(
+            f'#include "{name}.h"\nint {name}_{i}(void) {{ return {i}; }}\n')
+    (path / "XFKconfig").write_text(component_kconfig(prefix, name, symbols))
+    (path / "xf_collect.py").write_text(
+        COLLECT_SCRIPT.format(prefix=prefix, requires=requires))
+
+
+def generate(root: Path, components: int, sources: int = 4,
+             symbols: int = 4) -> Path:
+    """
+    生成 XF_ROOT，已存在时先删除
+
+    :param root: XF_ROOT 路径
+    :param components: 公共组件数量
+    :param sources: 每个组件的源文件数量
+    :param symbols: 每个组件 XFKconfig 中的宏数量
+    :return: 工程路径
+    """
+    root = Path(root).resolve()
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    (root / "export.sh").write_text(EXPORT_SCRIPT.format(
+        root=root.as_posix(), vendor=VENDOR, target=TARGET))
+    (root / "XFKconfig").write_text(ROOT_KCONFIG)
+
+    boards = root / "boards"
+    (boards / VENDOR / TARGET).mkdir(parents=True)
+    (boards / "XFKconfig").write_text(BOARDS_KCONFIG)
+    (boards / VENDOR / TARGET / "target.json").write_text('{"sdks": {}}\n')
+    (boards / VENDOR / TARGET / "xfconfig.defaults").write_text(
+        "CONFIG_BENCH_BOARD=2\n")
+
+    port = root / "ports" / VENDOR / TARGET
+    port.mkdir(parents=True)
+    (port / "port.c").write_text("int port_init(void) { return 0; }\n")
+    (port / "xf_collect.py").write_text(
+        'import xf_build\nxf_build.collect(srcs=["*.c"])\n')
+
+    plugin = root / "plugins" / TARGET
+    plugin.mkdir(parents=True)
+    (plugin / "__init__.py").write_text(PLUGIN_INIT.format(target=TARGET))
+    (plugin / f"{TARGET}.py").write_text(PLUGIN.format(target=TARGET))
+    (plugin / "component.j2").write_text(TEMPLATE)
+
+    for i in range(components):
+        write_component(root / "components" / f"comp{i}", i, sources, symbols)
+
+    project = root / "project"
+    (project / "main").mkdir(parents=True)
+    (project / "xf_project.py").write_text(PROJECT_SCRIPT)
+    (project / "main" / "main.c").write_text("int main(void) { return 0; }\n")
+    (project / "main" / "xf_collect.py").write_text(
+        'import xf_build\nxf_build.collect(srcs=["*.c"])\n')
+    return project
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试用的 XF_ROOT")
+    parser.add_argument("root", type=str, help="XF_ROOT 路径，已存在时会被删除")
+    parser.add_argument("-n", "--components", type=int, default=100,
+                        help="公共组件数量")
+    parser.add_argument("-m", "--sources", type=int, default=4,
+                        help="每个组件的源文件数量")
+    parser.add_argument("-k", "--symbols", type=int, default=4,
+                        help="每个组件 XFKconfig 中的宏数量")
+    args = parser.parse_args()
+    project = generate(Path(args.root), args.components, args.sources,
+                       args.symbols)
+    print(f"XF_ROOT: {Path(args.root).resolve()}")
+    print(f"project: {project}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,7 @@ setup(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     include_package_data=True,
     install_requires=[
         'jinja2',
@@ -31,7 +31,7 @@ setup(
     ],
     entry_points='''
         [console_scripts]
-        xf=xf_build.cmd.cmd:main
+        xf=xf_build.daemon:main
     ''',
     url="http://www.coral-zone.cc/",
     long_description=README,
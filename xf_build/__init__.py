@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
 # 该部分是给开发者于编译的时候调用的
-from .build import Project
-
 default_project = None
 program = None
 collect = None
@@ -11,8 +9,21 @@ get_define = None
 
 
 def project_init(user_dirs: list = []) -> None:
+    from .build import Project
+    bind_project(Project(user_dirs))
+
+
+def bind_project(project) -> None:
     global default_project, program, collect, collect_srcs, add_folders, get_define
-    default_project = Project(user_dirs)
+    default_project = project
     program = default_project.program
     collect = default_project.collect
     get_define = default_project.get_define
+
+
+def __getattr__(name):
+    # 延迟导入，xf 命令的入口不需要加载构建相关的模块
+    if name == "Project":
+        from .build import Project
+        return Project
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
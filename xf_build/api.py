@@ -2,135 +2,292 @@ import subprocess
 import json
 import os
 from pathlib import Path
-from .env import PROJECT_BUILD_ENV
-from .env import XF_ROOT
-from .env import XF_TARGET_PATH
-from .env import XF_PROJECT_PATH
-from .env import PROJECT_BUILD_PATH
-from .env import ROOT_PLUGIN
-from .env import PROJECT_CONFIG_PATH
-from jinja2 import FileSystemLoader, Environment
+from .env import BuildContext, get_context, get_build_jobs, BUILD_JOBS
+from jinja2 import FileSystemLoader, Environment, FileSystemBytecodeCache
 from .menuconfig import MenuConfig
+from .cache import file_stamp
+from .fileio import write_if_changed
+from .runner import CommandRunner, OutputStream, WARNING_PATTERN
+from .cc_cache import CompilerCache
+from .includes import IncludeIndex
+from . import profile
+import asyncio
 import logging
 import threading
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Union
 
-
-def exec_cmd(command: Union[str, List[str]]) -> Tuple[int, List[str], List[str]]:
-    def stream_reader(pipe, output_list):
-        for line in iter(pipe.readline, ''):
-            print(line.strip())
-            output_list.append(line.strip())
-        pipe.close()
-
+TEMPLATE_CACHE_DIR = "template_cache"
+
+# 插件文件夹 -> jinja2 环境
+_template_environments = {}
+# build_environ.json 路径 -> (文件指纹, 内容)
+_build_environs = {}
+# 默认上下文的路径，保留给直接导入这些常量的插件，访问时才读取环境变量
+_CONTEXT_NAMES = ("PROJECT_BUILD_ENV", "XF_ROOT", "XF_TARGET_PATH",
+                  "XF_PROJECT_PATH", "PROJECT_BUILD_PATH", "ROOT_PLUGIN",
+                  "PROJECT_CONFIG_PATH")
+
+
+def __getattr__(name):
+    if name in _CONTEXT_NAMES:
+        from . import env
+        return getattr(env, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def exec_cmd(command: Union[str, List[str]], max_lines: int = None,
+             match: str = None, log_file: Union[str, Path] = None,
+             echo: bool = True) -> Tuple[int, List[str], List[str]]:
+    """
+    执行命令，输出实时打印
+
+    默认返回全部输出。输出很多的命令（例如 SDK 的编译）可以通过 max_lines 或 match
+    只保留需要的行，完整的输出写入 log_file。
+
+    :param command: 命令
+    :param max_lines: stdout 和 stderr 各自只保留最后的行数，为 None 时保留全部
+    :param match: 只保留匹配该正则表达式的行，例如 api.WARNING_PATTERN
+    :param log_file: 同时把输出写入该文件
+    :param echo: 是否打印到终端
+    :return: (返回值, stdout 的行, stderr 的行)
+    """
     if isinstance(command, list):
         command = ' '.join(command)
 
     logging.info(f"exec cmd {command}")
 
-    stdout_lines = []
-    stderr_lines = []
-
-    process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, text=True,
-                               shell=True)
-
-    # Create threads to read stdout and stderr
-    stdout_thread = threading.Thread(target=stream_reader, args=(
-        process.stdout, stdout_lines))
-    stderr_thread = threading.Thread(target=stream_reader, args=(
-        process.stderr, stderr_lines))
-
-    # Start the threads
-    stdout_thread.start()
-    stderr_thread.start()
-
-    # Wait for the process to complete
-    process.wait()
-
-    # Wait for the threads to complete
-    stdout_thread.join()
-    stderr_thread.join()
-
-    return process.returncode, stdout_lines, stderr_lines
-
-
-def apply_template(temp, save, replace=None):
-    with open(PROJECT_BUILD_ENV, "r") as json_file:
+    lock = threading.Lock()
+    log = open(log_file, "wb") if log_file is not None else None
+    streams = [OutputStream(output if echo else None, lock, log,
+                            max_lines, match)
+               for output in (sys.stdout, sys.stderr)]
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, shell=True)
+        # 按块读取两个管道，整行写入终端
+        threads = [threading.Thread(target=stream.read, args=(pipe.fileno(),))
+                   for stream, pipe in zip(streams,
+                                           (process.stdout, process.stderr))]
+        for thread in threads:
+            thread.start()
+        process.wait()
+        for thread in threads:
+            thread.join()
+        process.stdout.close()
+        process.stderr.close()
+    finally:
+        if log is not None:
+            log.close()
+
+    return process.returncode, list(streams[0].lines), list(streams[1].lines)
+
+
+def exec_many(commands: List[Union[str, List[str]]], jobs: int = None,
+              prefixes: List[str] = None,
+              fail_fast: bool = True) -> List[int]:
+    """
+    并行执行多条命令，输出逐行加上前缀后实时打印
+
+    :param commands: 命令列表，每条命令与 exec_cmd 的参数相同
+    :param jobs: 最大并行数，默认为 xf build -j 的值，未指定时为 cpu 核数。
+                 由 make 调用且继承了 jobserver 时，同时受 jobserver 的令牌限制
+    :param prefixes: 每条命令输出的前缀，默认为 [序号]
+    :param fail_fast: 有命令失败时终止正在执行的命令，不再执行剩余的命令
+    :return: 每条命令的返回值，未执行的命令为 None
+    """
+    commands = [' '.join(i) if isinstance(i, list) else i for i in commands]
+    if prefixes is None:
+        prefixes = [f"[{i}]" for i in range(len(commands))]
+    if jobs is None:
+        jobs = get_build_jobs() if os.environ.get(BUILD_JOBS) else \
+            os.cpu_count() or 1
+
+    runner = CommandRunner(jobs, fail_fast)
+    codes = asyncio.run(runner.run(commands, prefixes))
+    failed = [f"{prefix}={code}" for prefix, code in zip(prefixes, codes)
+              if code not in (0, None)]
+    if failed:
+        logging.error(f"命令执行失败: {', '.join(failed)}")
+    return codes
+
+
+def cc_cache_command(compiler: str) -> str:
+    """
+    生成通过编译缓存调用编译器的命令，插件生成编译脚本时用它代替编译器
+
+    :param compiler: 编译器，例如 arm-none-eabi-gcc
+    :return: 例如 "xf cc-cache arm-none-eabi-gcc"
+    """
+    return f"xf cc-cache {compiler}"
+
+
+def compile_cached(compiler: str, args: List[str]) -> int:
+    """
+    在当前进程中通过编译缓存编译一个源文件，无法缓存的命令直接调用编译器
+
+    :param compiler: 编译器
+    :param args: 编译器的参数
+    :return: 编译器的返回值
+    """
+    return CompilerCache.from_context().compile(compiler, args)
+
+
+def get_header_dependents(header: str) -> dict:
+    """
+    查询依赖某个头文件的组件和源文件，头文件依赖索引不是最新时先增量更新
+
+    :param header: 头文件的路径或者路径的结尾部分，例如 "xfconfig.h"
+    :return: 组件名 -> [源文件, ...]
+    """
+    ctx = get_context()
+    return IncludeIndex.load_project(ctx, load_build_environ(ctx)) \
+        .dependents(header)
+
+
+def get_source_headers(source: str) -> List[str]:
+    """
+    查询源文件直接或间接包含的头文件
+
+    :param source: 源文件路径
+    :return: 头文件路径
+    """
+    ctx = get_context()
+    index = IncludeIndex.load_project(ctx, load_build_environ(ctx))
+    item = index.sources.get(Path(source).resolve().as_posix())
+    return list(item[1]) if item is not None else []
+
+
+def get_template_environment(ctx: BuildContext = None) -> Environment:
+    """
+    获取插件模板的 jinja2 环境，每个插件文件夹只创建一次。
+    编译后的模板缓存在 XF_ROOT/build/template_cache 下，模板未修改时不需要重新编译。
+
+    :param ctx: 编译上下文，默认为当前上下文
+    """
+    ctx = ctx or get_context()
+    key = ctx.ROOT_PLUGIN.as_posix()
+    env = _template_environments.get(key)
+    if env is None:
+        cache_path = ctx.ROOT_BUILD_PATH / TEMPLATE_CACHE_DIR
+        cache_path.mkdir(parents=True, exist_ok=True)
+        env = Environment(loader=FileSystemLoader(ctx.ROOT_PLUGIN),
+                          bytecode_cache=FileSystemBytecodeCache(
+                              cache_path.as_posix()))
+        _template_environments[key] = env
+    return env
+
+
+def load_build_environ(ctx: BuildContext = None) -> dict:
+    """
+    读取 build_environ.json，文件未改变时复用上次读取的内容，调用者不能修改返回值
+
+    :param ctx: 编译上下文，默认为当前上下文
+    """
+    ctx = ctx or get_context()
+    path = ctx.PROJECT_BUILD_ENV.as_posix()
+    stamp = file_stamp(path)
+    cached = _build_environs.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as json_file:
         config_data = json.load(json_file)
+    _build_environs[path] = (stamp, config_data)
+    return config_data
 
-    file_loader = FileSystemLoader(ROOT_PLUGIN)
-    env = Environment(loader=file_loader)
 
-    template = env.get_template(temp)
-    output = template.render(config_data)
+def apply_template(temp, save, replace=None):
+    config_data = load_build_environ()
+    template = get_template_environment().get_template(temp)
+    with profile.span(temp, "template", save=str(save)):
+        output = template.render(config_data)
 
     if replace is not None:
         for key, value in replace.items():
             output = output.replace(key, value)
 
-    with open(save, 'w') as output_file:
-        output_file.write(output)
+    if write_if_changed(save, output):
+        logging.info(f"Template applied successfully to {save}")
+    else:
+        logging.debug(f"Template output unchanged: {save}")
 
-    logging.info(f"Template applied successfully to {save}")
 
+def apply_components_template(temp, suffix, jobs: int = None):
+    """
+    为每个组件渲染模板，保存到 build/<组件类型>/<组件名> 下，内容未改变的文件不会写入
+
+    :param temp: 模板名称
+    :param suffix: 以 . 开头时保存为 <组件名><suffix>，否则为文件名
+    :param jobs: 并行渲染的线程数，默认与 xf build -j 相同
+    """
+    ctx = get_context()
 
-def apply_components_template(temp, suffix):
     def template_generation(config_data, save_path):
-        output = template.render(config_data)
-        save_path = Path(PROJECT_BUILD_PATH).joinpath(*save_path)
-        if not save_path.exists():
-            save_path.mkdir(parents=True, exist_ok=True)
+        with profile.span(save_path[-1], "template", template=temp):
+            output = template.render(config_data)
+        save_path = Path(ctx.PROJECT_BUILD_PATH).joinpath(*save_path)
         if suffix[0] == '.':
             final_save = save_path / (save_path.name + suffix)
         else:
             final_save = save_path / suffix
-        with open(final_save, 'w') as output_file:
-            output_file.write(output)
-        logging.info(f"Template applied successfully to {final_save}")
-
-    with open(PROJECT_BUILD_ENV, "r") as json_file:
-        config_data = json.load(json_file)
-
-    file_loader = FileSystemLoader(ROOT_PLUGIN)
-    env = Environment(loader=file_loader)
-    template = env.get_template(temp)
-
-    for i in config_data["public_components"]:
-        template_generation(config_data["public_components"][i], [
-                            "public_components", i])
+        if write_if_changed(final_save, output):
+            logging.info(f"Template applied successfully to {final_save}")
+        else:
+            logging.debug(f"Template output unchanged: {final_save}")
 
-    for i in config_data["user_components"]:
-        template_generation(config_data["user_components"][i], [
-                            "user_components", i])
+    config_data = load_build_environ(ctx)
+    template = get_template_environment(ctx).get_template(temp)
 
-    for i in config_data["user_dirs"]:
-        template_generation(config_data["user_dirs"][i], [
-                            "user_dirs", i])
+    items = []
+    for kind in ("public_components", "user_components", "user_dirs"):
+        for i in config_data[kind]:
+            items.append((config_data[kind][i], [kind, i]))
+    items.append((config_data["user_main"], ["user_main"]))
 
-    template_generation(config_data["user_main"], ["user_main"])
+    jobs = jobs or get_build_jobs()
+    if jobs <= 1:
+        for item in items:
+            template_generation(*item)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(template_generation, *item)
+                       for item in items]:
+            future.result()
 
 
 def get_define(define):
-    config = MenuConfig(PROJECT_CONFIG_PATH,
-                        XF_TARGET_PATH, PROJECT_BUILD_PATH)
-    return config.get_macro(define)
+    """
+    获取menuconfig产生的宏，在收集脚本中调用时会记录到收集缓存中
+    """
+    from . import default_project
+    ctx = get_context()
+    key = None
+    if default_project is not None:
+        if default_project.collecting:
+            return default_project.get_define(define)
+        # 本次编译已经加载过快照，直接使用其指纹，不再检查所有的 Kconfig 文件
+        if default_project.ctx.PROJECT_BUILD_PATH == ctx.PROJECT_BUILD_PATH:
+            key = default_project.config_key
+    snapshot = MenuConfig.load_snapshot(ctx, key)
+    return snapshot.get_macro(define)
 
 
 def cd_to_root():
-    os.chdir(XF_ROOT)
+    os.chdir(get_context().XF_ROOT)
 
 
 def cd_to_target():
-    os.chdir(XF_TARGET_PATH)
+    os.chdir(get_context().XF_TARGET_PATH)
 
 
 def cd_to_project():
-    os.chdir(XF_PROJECT_PATH)
+    os.chdir(get_context().XF_PROJECT_PATH)
 
 
 def get_sdk_dir():
-    target_json_path = Path(XF_TARGET_PATH) / "target.json"
+    target_json_path = get_context().XF_TARGET_PATH / "target.json"
     if not target_json_path.exists():
         return ""
     with target_json_path.open("r", encoding="utf-8") as f:
@@ -141,24 +298,24 @@ def get_sdk_dir():
 
 
 def get_XF_ROOT():
-    return XF_ROOT
+    return get_context().XF_ROOT
 
 
 def get_XF_TARGET_PATH():
-    return XF_TARGET_PATH
+    return get_context().XF_TARGET_PATH
 
 
 def get_XF_PROJECT_PATH():
-    return XF_PROJECT_PATH
+    return get_context().XF_PROJECT_PATH
 
 
 def get_PROJECT_BUILD_PATH():
-    return PROJECT_BUILD_PATH
+    return get_context().PROJECT_BUILD_PATH
 
 
 def get_ROOT_PLUGIN():
-    return ROOT_PLUGIN
+    return get_context().ROOT_PLUGIN
 
 
 def get_PROJECT_CONFIG_PATH():
-    return PROJECT_CONFIG_PATH
+    return get_context().PROJECT_CONFIG_PATH
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .env import ENTER_SCRIPT, COLLECT_SCRIPT, BUILD_JOBS
+from .env import BuildContext, get_context, use_context
+from .env import is_project, exec_project
+from .loader import load_script
+from .indexer import source_index, SourceIndex
+
+# 批量编译时每个任务的编译产物保存在 build/targets/<目标> 下
+BATCH_BUILD_DIR = "targets"
+BATCH_LOG_NAME = "build.log"
+
+
+class BuildJob:
+    """
+    批量编译中的一个任务：一个目标和一个工程的组合
+
+    :param ctx: 任务的编译上下文，编译产物路径互相独立
+    """
+
+    def __init__(self, ctx: BuildContext) -> None:
+        self.ctx = ctx
+        self.log_path = ctx.PROJECT_BUILD_PATH / BATCH_LOG_NAME
+
+    @property
+    def name(self) -> str:
+        return f"{self.ctx.XF_TARGET}/{self.ctx.XF_PROJECT}"
+
+
+def resolve_target(name: str, ctx: BuildContext) -> Path:
+    """
+    根据目标名称查找 boards 下的目标文件夹，也可以直接指定文件夹
+
+    :param name: 目标名称或路径
+    :return: 目标文件夹
+    """
+    path = Path(name)
+    if path.is_dir():
+        return path.resolve()
+    found = [i for i in [ctx.ROOT_BOARDS / name] +
+             sorted(ctx.ROOT_BOARDS.glob(f"*/{name}")) if i.is_dir()]
+    if not found:
+        raise Exception(f"找不到目标: {name}")
+    if len(found) > 1:
+        raise Exception(f"目标名称不唯一: {name}, 请指定路径")
+    return found[0].resolve()
+
+
+def create_jobs(targets: list, projects: list) -> list:
+    """
+    创建目标和工程的所有组合
+
+    :param targets: 目标名称或路径，为空时使用当前目标
+    :param projects: 工程路径，为空时使用当前工程
+    """
+    default = get_context()
+    target_paths = [resolve_target(i, default) for i in targets] or \
+        [default.XF_TARGET_PATH]
+    project_paths = [Path(i).resolve() for i in projects] or \
+        [default.XF_PROJECT_PATH]
+
+    jobs = []
+    for project_path in project_paths:
+        is_project(project_path)
+        for target_path in target_paths:
+            build_path = project_path / "build" / BATCH_BUILD_DIR / \
+                target_path.name
+            ctx = BuildContext(default.XF_ROOT, target_path.name, target_path,
+                               project_path, build_path=build_path)
+            jobs.append(BuildJob(ctx))
+    return jobs
+
+
+def prewarm(jobs: list) -> None:
+    """
+    在创建进程池之前完成与目标无关的工作：编译所有收集脚本，读取组件文件夹。
+    子进程通过 fork 继承这些结果，每个任务不需要重复执行。
+    """
+    scripts = {}
+    dirs = set()
+    for job in jobs:
+        ctx = job.ctx
+        scripts[ctx.XF_PROJECT_PATH / ENTER_SCRIPT] = ctx.PROJECT_BUILD_PATH
+        candidates = [ctx.ROOT_PORT, ctx.XF_PROJECT_PATH / "main"]
+        for root in (ctx.ROOT_COMPONENTS, ctx.PROJECT_COMPONENTS):
+            if root.is_dir():
+                candidates.extend(sorted(root.iterdir()))
+        for i in candidates:
+            if (i / COLLECT_SCRIPT).exists():
+                scripts[i / COLLECT_SCRIPT] = ctx.PROJECT_BUILD_PATH
+                dirs.add(i.as_posix())
+
+    for job in jobs:
+        source_index.load(job.ctx.PROJECT_BUILD_PATH / SourceIndex.INDEX_NAME)
+    for i in sorted(dirs):
+        source_index.listdir(i)
+    for script_path, build_path in scripts.items():
+        load_script(script_path, build_path)
+    logging.debug(f"预先编译 {len(scripts)} 个脚本，读取 {len(dirs)} 个文件夹")
+
+
+def run_job(job: BuildJob, plugin_args: list, test: bool) -> int:
+    """
+    在子进程中执行一个任务，日志和输出都写入任务的日志文件
+
+    :param job: 编译任务
+    :param plugin_args: 传递给插件的参数
+    :param test: 测试模式，不调用插件
+    :return: 任务的返回值
+    """
+    from .plugins import Plugins
+
+    ctx = job.ctx
+    ctx.PROJECT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    logger = logging.getLogger()
+    handlers = logger.handlers[:]
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    code = 0
+    with open(job.log_path, "w", encoding="utf-8") as log:
+        # 插件启动的编译器等子进程的输出也写入日志
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s: %(message)s', datefmt="%H:%M:%S"))
+        logger.handlers = [handler]
+        try:
+            os.chdir(ctx.XF_PROJECT_PATH)
+            os.environ.clear()
+            os.environ.update(ctx.environ())
+            # 任务之间已经并行，任务内部串行收集
+            os.environ[BUILD_JOBS] = "1"
+            with use_context(ctx):
+                exec_project(ctx)
+                if not test:
+                    hook = Plugins(ctx.ROOT_PLUGIN).get_hook()
+                    hook.build(plugin_args)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logging.exception(f"{job.name} 编译失败")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            logger.handlers = handlers
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+    return code
+
+
+def _timed_job(job: BuildJob, plugin_args: list, test: bool) -> tuple:
+    start = time.perf_counter()
+    code = run_job(job, plugin_args, test)
+    return code, time.perf_counter() - start
+
+
+def batch_build(targets: list, projects: list, jobs: int = None,
+                plugin_args: list = [], test: bool = False) -> int:
+    """
+    在进程池中编译多个目标和工程的组合
+
+    :param targets: 目标名称或路径
+    :param projects: 工程路径
+    :param jobs: 同时执行的任务数，默认为 cpu 核数
+    :param plugin_args: 传递给插件的参数
+    :param test: 测试模式，不调用插件
+    :return: 失败的任务数
+    """
+    build_jobs = create_jobs(targets, projects)
+    prewarm(build_jobs)
+    workers = min(jobs or os.cpu_count() or 1, len(build_jobs))
+    logging.info(f"批量编译 {len(build_jobs)} 个任务，{workers} 个进程")
+
+    # fork 的子进程可以直接使用预先编译的脚本和文件夹索引
+    methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context(
+        "fork" if "fork" in methods else None)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=mp_context) as executor:
+        futures = {executor.submit(_timed_job, job, plugin_args, test): job
+                   for job in build_jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                results[job] = future.result()
+            except Exception as e:
+                logging.error(f"{job.name} 任务异常: {e}")
+                results[job] = (1, 0.0)
+            code, duration = results[job]
+            if code == 0:
+                logging.info(f"{job.name} 完成 ({duration:.2f}s)")
+            else:
+                logging.error(f"{job.name} 失败，日志: {job.log_path}")
+
+    show_summary(build_jobs, results)
+    return sum(1 for code, _ in results.values() if code != 0)
+
+
+def show_summary(build_jobs: list, results: dict) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title="批量编译结果")
+    table.add_column("目标", style="cyan")
+    table.add_column("工程", style="magenta")
+    table.add_column("结果")
+    table.add_column("耗时", justify="right")
+    table.add_column("日志")
+    for job in build_jobs:
+        code, duration = results[job]
+        status = "[green]成功[/green]" if code == 0 else \
+            f"[red]失败 ({code})[/red]"
+        table.add_row(job.ctx.XF_TARGET, job.ctx.XF_PROJECT, status,
+                      f"{duration:.2f}s", job.log_path.as_posix())
+    Console().print(table)
@@ -2,25 +2,56 @@
 
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import sys
-import json
 
-from .env import XF_PROJECT, XF_PROJECT_PATH
-from .env import PROJECT_BUILD_PATH, PROJECT_BUILD_INFO
-from .env import ROOT_COMPONENTS, PROJECT_COMPONENTS
-from .env import COLLECT_SCRIPT, PROJECT_BUILD_ENV, ROOT_PORT
-from .env import PROJECT_CONFIG_PATH, XF_TARGET_PATH
+from .env import COLLECT_SCRIPT
+from .env import BuildContext, get_context, use_context
+from .env import get_build_jobs
 from .menuconfig import MenuConfig
+from .cache import CollectCache, hash_json
+from .loader import load_script
+from .indexer import SourceIndex, source_index, FILE
+from .fileio import dump_json, log_changed_artifacts
+from .depgraph import DependencyGraph, MAIN, COMPONENT_KINDS
+from .includes import IncludeIndex
+from . import profile
+
+
+class UniqueList(list):
+    """
+    保持插入顺序的去重列表，可以直接保存成 json
+    """
+
+    def __init__(self, iterable=()) -> None:
+        super().__init__()
+        self.seen = set()
+        self.extend(iterable)
+
+    def __reduce__(self):
+        return (UniqueList, (list(self),))
+
+    def append(self, item) -> None:
+        if item in self.seen:
+            return
+        self.seen.add(item)
+        super().append(item)
+
+    def extend(self, iterable) -> None:
+        for item in iterable:
+            self.append(item)
 
 
 class Project:
-    def __init__(self, user_dirs=[]) -> None:
+    def __init__(self, user_dirs=[], ctx: BuildContext = None) -> None:
         """
         完成env的创建，完成自定义指令的创建
 
-        :param user_dirs: 用户额外添加的文件夹
+        :param user_dirs: 用户额外添加的文件夹，相对于工程路径
+        :param ctx: 编译上下文，默认为当前上下文
         """
+        self.ctx = ctx or get_context()
         self.build_env = {
             "project_name": " ",
             "user_components": {},
@@ -33,31 +64,231 @@ class Project:
         }
 
         # 用户工程路径，menuconfig生成的配置头文件路径
-        self.build_env["project_name"] = XF_PROJECT
+        self.build_env["project_name"] = self.ctx.XF_PROJECT
         self.build_env["config_path"] = (
-            PROJECT_BUILD_PATH / MenuConfig.HEADER_DIR).as_posix()
+            self.ctx.PROJECT_BUILD_PATH / MenuConfig.HEADER_DIR).as_posix()
 
         # 编译生成的产物路径
-        if not PROJECT_BUILD_PATH.exists():
-            PROJECT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
+        if not self.ctx.PROJECT_BUILD_PATH.exists():
+            self.ctx.PROJECT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
+
+        # 当前收集脚本 glob 过的文件夹以及读取过的宏定义及其取值，用于收集缓存
+        self.glob_dirs = set()
+        self.config_symbols = {}
+        # 是否正在执行收集脚本，此时 api.get_define 读取的宏也会被记录
+        self.collecting = False
+        # 组件名 -> 收集脚本读取过的宏定义
+        self.config_usage = {}
+        # menuconfig 快照的指纹，在扫描 XFKconfig 之后计算
+        self.config_key = None
+        # 是否裁剪未被依赖的公共组件
+        self.prune = False
+        # 是否为每个宏生成单独的头文件
+        self.split_config = False
 
         self.user_dirs = []
         if user_dirs == []:
             return
+        project_path = self.ctx.XF_PROJECT_PATH
         for i in user_dirs:
             if "*" in i:
-                self.user_dirs.extend(Path('.').glob(i))
+                self.user_dirs.extend(sorted(project_path.glob(i)))
                 self.user_dirs = [i.resolve() for i in self.user_dirs]
             else:
-                self.user_dirs.append(Path(i).resolve())
+                self.user_dirs.append((project_path / i).resolve())
 
-    def program(self, cflags: list = []):
+    def program(self, cflags: list = [], prune: bool = False,
+                split_config: bool = False, scan_includes: bool = False):
         """
         工程建立，这里开始调用最外层脚本开始构建工程
 
         :param cflags: 影响全局的cflags
+        :param prune: 只收集 main 直接或间接依赖的公共组件，并按照依赖顺序输出
+        :param split_config: 为每个宏生成单独的头文件，并输出宏与组件的对应关系，
+            需要扫描源文件，同时会生成头文件依赖索引
+        :param scan_includes: 扫描源文件的 #include，生成头文件依赖索引
         """
         self.build_env["cflags"] = cflags
+        self.prune = prune
+        self.split_config = split_config
+        ctx = self.ctx
+        # 搜索组件、扫描 XFKconfig 和收集脚本的 glob 共用文件夹索引
+        source_index.load(ctx.PROJECT_BUILD_PATH / SourceIndex.INDEX_NAME)
+        with profile.span("discover"):
+            build_info = self.discover()
+
+        # 保存成json
+        dump_json(ctx.PROJECT_BUILD_INFO, build_info)
+
+        # 扫描XFKconfig并生成头文件
+        with profile.span("scan_kconfig"):
+            MenuConfig.scan_kconfig(ctx, build_info)
+
+        # 执行脚本，指纹未改变的组件直接使用缓存
+        with profile.span("menuconfig"):
+            # 每次编译只生成一次头文件，收集脚本中的 get_define 只读取快照
+            snapshot = MenuConfig.load_snapshot(ctx)
+            self.config_key = snapshot.key
+            snapshot.write_header(MenuConfig.header_file(ctx), split_config)
+        cache = CollectCache(ctx.PROJECT_BUILD_PATH / CollectCache.CACHE_NAME,
+                             self.components_key(), snapshot)
+        with profile.span("collect_components"):
+            if prune:
+                # 公共组件只有被依赖时才会执行收集脚本
+                self.collect_components([Path(i).resolve()
+                                         for kind, values in build_info.items()
+                                         if kind != "public_components"
+                                         for i in values], cache)
+                self.collect_reachable(cache)
+                self.prune_components()
+            else:
+                self.collect_components([Path(i).resolve()
+                                         for values in build_info.values()
+                                         for i in values], cache)
+                self.check_components()
+        cache.save()
+        source_index.save()
+
+        # 收集编译信息保存成json
+        dump_json(ctx.PROJECT_BUILD_ENV, self.build_env)
+        if scan_includes or split_config:
+            with profile.span("scan_includes"):
+                index = IncludeIndex.scan_project(ctx, self.build_env)
+        if split_config:
+            dump_json(ctx.PROJECT_BUILD_PATH / MenuConfig.USAGE_NAME,
+                      self.config_usage_map(snapshot, index))
+        log_changed_artifacts()
+
+    def collect_components(self, script_dirs: list,
+                           cache: CollectCache) -> None:
+        """
+        收集组件，指纹未改变的组件直接使用缓存，其余的串行或者并行执行收集脚本
+
+        :param script_dirs: 组件文件夹
+        :param cache: 收集结果缓存
+        """
+        stale = [i for i in script_dirs if not self.load_cache(i, cache)]
+        jobs = get_build_jobs()
+        if jobs > 1 and len(stale) > 1:
+            self.collect_parallel(stale, cache, jobs)
+        else:
+            for script_dir in stale:
+                self.exec_collect(script_dir)
+                cache.put(script_dir, self.get_env(script_dir),
+                          self.glob_dirs, self.config_symbols)
+                self.config_usage[script_dir.name] = \
+                    sorted(self.config_symbols)
+
+    def root_components(self, graph: DependencyGraph) -> list:
+        """
+        裁剪模式下始终保留的组件：main，移植对接，用户组件和用户目录
+        """
+        return [MAIN] + graph.names("public_port") + \
+            graph.names("user_components") + graph.names("user_dirs")
+
+    def collect_reachable(self, cache: CollectCache) -> None:
+        """
+        按照依赖关系逐层收集被依赖的公共组件
+        """
+        collected = set()
+        while True:
+            graph = DependencyGraph(self.build_env)
+            reachable = graph.reachable(self.root_components(graph))
+            pending = [name for name in graph.names("public_components")
+                       if name in reachable and name not in collected]
+            if not pending:
+                return
+            collected.update(pending)
+            components = self.build_env["public_components"]
+            self.collect_components([Path(components[i]["path"])
+                                     for i in pending], cache)
+
+    def prune_components(self) -> None:
+        """
+        删除没有被依赖的公共组件，检查依赖关系，并按照拓扑顺序排列组件
+        """
+        graph = DependencyGraph(self.build_env)
+        reachable = graph.reachable(self.root_components(graph))
+        components = self.build_env["public_components"]
+        dropped = [i for i in components if i not in reachable]
+        for name in dropped:
+            del components[name]
+        if dropped:
+            logging.info(f"裁剪未被依赖的组件: {', '.join(dropped)}")
+
+        graph = DependencyGraph(self.build_env)
+        graph.check()
+        order = graph.topo_order()
+        for kind in COMPONENT_KINDS:
+            self.build_env[kind] = {name: self.build_env[kind][name]
+                                    for name in order
+                                    if graph.kinds[name] == kind}
+
+        # main 依赖所有保留下来的组件
+        main_env = self.build_env["user_main"]
+        main_env["requires"] = UniqueList(main_env["requires"])
+        main_env["requires"].extend(i for i in order if i != MAIN)
+
+    def check_components(self) -> None:
+        """
+        检查依赖关系，存在问题时只给出警告
+        """
+        graph = DependencyGraph(self.build_env)
+        cycle = graph.find_cycle()
+        if cycle is not None:
+            logging.warning(f"组件存在循环依赖: {' -> '.join(cycle)}")
+        for name, dep in graph.missing():
+            logging.warning(f"组件 {name} 依赖的 {dep} 不存在")
+
+    def config_usage_map(self, snapshot, index: IncludeIndex) -> dict:
+        """
+        宏与组件的对应关系：定义宏的组件，源文件或者其包含的头文件中引用了该宏的组件，
+        以及收集脚本读取了该宏的组件
+
+        :param snapshot: menuconfig 的快照
+        :param index: 已经扫描过的头文件依赖索引
+        :return: 宏名 -> {"defined_in": 组件名, "used_by": [组件名, ...],
+                         "read_by": [组件名, ...]}
+        """
+        components = {}
+        for kind in COMPONENT_KINDS + ("user_main",):
+            envs = self.build_env[kind]
+            if kind == "user_main":
+                envs = {MAIN: envs}
+            for name, env in envs.items():
+                components[env["path"]] = name
+
+        usage = {}
+        for symbol, filename in sorted(snapshot.sources.items()):
+            component = components.get(Path(filename).parent.as_posix())
+            usage[symbol] = {"defined_in": component, "used_by": [],
+                             "read_by": []}
+        # 生成的 xfconfig.h 引用了所有的宏，不计入
+        sources = index.config_usage(self.build_env["config_path"])
+        for name, symbols in sources.items():
+            # tristate 的 m 生成 CONFIG_<NAME>_MODULE
+            symbols = {i[:-len("_MODULE")] if i not in usage and
+                       i.endswith("_MODULE") else i for i in symbols}
+            for symbol in symbols:
+                if symbol in usage:
+                    usage[symbol]["used_by"].append(name)
+        for name, symbols in self.config_usage.items():
+            for symbol in symbols:
+                if symbol in usage:
+                    usage[symbol]["read_by"].append(name)
+        for item in usage.values():
+            item["used_by"].sort()
+            item["read_by"].sort()
+        return usage
+
+    def discover(self) -> dict:
+        """
+        搜索所有含有收集脚本的组件，建立 build_env 的框架
+
+        组件文件夹的列表来自文件夹索引，文件夹未改变时每个组件只需要 stat 一次
+
+        :return: 各类组件的路径，即 build_info.json 的内容
+        """
         build_info = {
             "user_components": [],
             "user_dirs": [],
@@ -66,228 +297,204 @@ class Project:
             "user_main": [],
         }
         components_name = []
+        ctx = self.ctx
 
-        # 收集移植对接
-        port_path = (ROOT_PORT / COLLECT_SCRIPT).resolve()
-        name = ROOT_PORT.name
-        if name in components_name:
-            logging.error(f"组件名重复{name}")
-            raise ValueError(f"component {name} already exists")
-        components_name.append(name)
-        self.build_env["public_port"][name] = {}
-        self.build_env["public_port"][name]["path"] = ROOT_PORT.as_posix()
-        self.build_env["public_port"][name]["srcs"] = []
-        self.build_env["public_port"][name]["inc_dirs"] = []
-        self.build_env["public_port"][name]["requires"] = []
-        self.build_env["public_port"][name]["cflags"] = []
-        # 收集路径
-        build_info["public_port"].append(port_path.parent.as_posix())
-
-        # 收集全局组件
-        for item in ROOT_COMPONENTS.iterdir():
-            full_path = ROOT_COMPONENTS / item
-            if full_path.is_file():
-                continue  # 如果是文件，则跳过
-
-            script_path = (full_path / COLLECT_SCRIPT).resolve()
-            if not script_path.exists():
-                continue  # 如果脚本不存在，则跳过
-            name = full_path.name
+        def add_component(kind: str, path: Path) -> None:
+            name = path.name
             if name in components_name:
                 logging.error(f"组件名重复{name}")
                 raise ValueError(f"component {name} already exists")
             components_name.append(name)
-            self.build_env["public_components"][name] = {}
-            self.build_env["public_components"][name]["path"] = full_path.as_posix()
-            self.build_env["public_components"][name]["srcs"] = []
-            self.build_env["public_components"][name]["inc_dirs"] = []
-            self.build_env["public_components"][name]["requires"] = []
-            self.build_env["public_components"][name]["cflags"] = []
+            self.build_env[kind][name] = self.new_env(path)
             # 收集路径
-            build_info["public_components"].append(full_path.as_posix())
+            build_info[kind].append(path.as_posix())
+
+        def components_in(directory: Path) -> list:
+            # 跳过文件以及没有收集脚本的文件夹，条目已经按名称排序
+            result = []
+            for name, kind in source_index.listdir(directory.as_posix()):
+                if kind == FILE:
+                    continue
+                path = directory / name
+                if [COLLECT_SCRIPT, FILE] in \
+                        source_index.listdir(path.as_posix()):
+                    result.append(path)
+            return result
+
+        # 收集移植对接
+        add_component("public_port", ctx.ROOT_PORT)
+
+        # 收集全局组件
+        for full_path in components_in(ctx.ROOT_COMPONENTS):
+            add_component("public_components", full_path)
 
         # 收集用户组件
-        if PROJECT_COMPONENTS.exists():
-            for item in PROJECT_COMPONENTS.iterdir():
-                full_path = PROJECT_COMPONENTS / item
-                if full_path.is_file():
-                    continue  # 如果是文件，则跳过
-
-                script_path = (full_path / COLLECT_SCRIPT).resolve()
-                if not script_path.exists():
-                    continue  # 如果脚本不存在，则跳过
-                name = full_path.name
-                if name in components_name:
-                    logging.error(f"组件名重复{name}")
-                    raise ValueError(f"component {name} already exists")
-                components_name.append(name)
-                self.build_env["user_components"][name] = {}
-                self.build_env["user_components"][name]["path"] = full_path.as_posix()
-                self.build_env["user_components"][name]["srcs"] = []
-                self.build_env["user_components"][name]["inc_dirs"] = []
-                self.build_env["user_components"][name]["requires"] = []
-                self.build_env["user_components"][name]["cflags"] = []
-                # 收集路径
-                build_info["user_components"].append(full_path.as_posix())
+        for full_path in components_in(ctx.PROJECT_COMPONENTS):
+            add_component("user_components", full_path)
 
         # 收集用户目录
         for user_dir in self.user_dirs:
             script_path: Path = (user_dir / COLLECT_SCRIPT).resolve()
             if not script_path.exists():
                 continue  # 如果脚本不存在，则跳过
-            name = full_path.name
-            if name in components_name:
-                logging.error(f"组件名重复{name}")
-                raise ValueError(f"component {name} already exists")
-            components_name.append(name)
-            self.build_env["user_dirs"][name] = {}
-            self.build_env["user_dirs"][name]["path"] = user_dir.as_posix()
-            self.build_env["user_dirs"][name]["srcs"] = []
-            self.build_env["user_dirs"][name]["inc_dirs"] = []
-            self.build_env["user_dirs"][name]["requires"] = []
-            self.build_env["user_dirs"][name]["cflags"] = []
-            # 收集路径
-            build_info["user_dirs"].append(user_dir.as_posix())
+            add_component("user_dirs", user_dir)
 
         # 处理主程序下的内容
-        main_path = Path(f"main/{COLLECT_SCRIPT}").resolve()
+        main_path = (ctx.XF_PROJECT_PATH / "main" / COLLECT_SCRIPT).resolve()
         if not main_path.exists():
             logging.error(f"must have main and main/{COLLECT_SCRIPT}")
             raise FileNotFoundError(
                 f"must have main and main/{COLLECT_SCRIPT}")
-        self.build_env["user_main"]["path"] = main_path.parent.as_posix()
-        self.build_env["user_main"]["srcs"] = []
-        self.build_env["user_main"]["inc_dirs"] = []
-        self.build_env["user_main"]["requires"] = []
-        self.build_env["user_main"]["cflags"] = []
+        self.build_env["user_main"] = self.new_env(main_path.parent)
         # 收集路径
         build_info["user_main"].append(main_path.parent.as_posix())
 
-        # 保存成json
-        with PROJECT_BUILD_INFO.open("w", encoding="utf-8") as f:
-            json.dump(build_info, f, indent=4)
+        return build_info
 
-        # 扫描XFKconfig并生成头文件
-        MenuConfig.scan_kconfig()
-
-        # 执行脚本
-        for values in build_info.values():
-            for value in values:
-                self.script_path = Path(value).resolve()
-                script_path = self.script_path / COLLECT_SCRIPT
-                logging.info(f"run script {script_path}")
-                sys.path.append(self.script_path.as_posix())
-                with script_path.open("r", encoding="utf-8") as f:
-                    exec(f.read())
-        # 收集编译信息保存成json
-        with PROJECT_BUILD_ENV.open("w", encoding="utf-8") as f:
-            json.dump(self.build_env, f, indent=4)
+    @staticmethod
+    def new_env(path: Path) -> dict:
+        """
+        创建组件在 build_env 中的空条目
+        """
+        return {
+            "path": path.as_posix(),
+            "srcs": UniqueList(),
+            "inc_dirs": UniqueList(),
+            "requires": UniqueList(),
+            "cflags": UniqueList(),
+        }
+
+    def components_key(self) -> str:
+        """
+        组件列表的指纹，main 的 requires 依赖于全部组件名
+        """
+        names = [list(self.build_env[kind].keys()) for kind in
+                 ("public_components", "user_components",
+                  "user_dirs", "public_port")]
+        return hash_json([names, self.build_env["config_path"], self.prune])
+
+    def get_env(self, script_path: Path) -> dict:
+        """
+        根据组件文件夹获取其在 build_env 中的条目
+        """
+        name: str = script_path.name
+        script_dir = script_path.parent
+        if name == "main":
+            return self.build_env["user_main"]
+        elif script_dir == self.ctx.ROOT_COMPONENTS:
+            return self.build_env["public_components"][name]
+        elif script_dir == self.ctx.PROJECT_COMPONENTS:
+            return self.build_env["user_components"][name]
+        elif script_dir == self.ctx.ROOT_PORT.parent:
+            return self.build_env["public_port"][name]
+        else:
+            return self.build_env["user_dirs"][name]
+
+    def load_cache(self, script_dir: Path, cache: CollectCache) -> bool:
+        """
+        使用缓存的收集结果填充组件
+
+        :param script_dir: 组件文件夹
+        :param cache: 收集结果缓存
+        :return: 缓存是否有效
+        """
+        cached = cache.get(script_dir)
+        if cached is None:
+            return False
+        logging.debug(f"use cache {script_dir}")
+        self.get_env(script_dir).update(cached)
+        self.config_usage[script_dir.name] = cache.symbols(script_dir)
+        return True
+
+    def exec_collect(self, script_dir: Path) -> None:
+        """
+        执行组件的收集脚本
+
+        :param script_dir: 组件文件夹
+        """
+        self.script_path = script_dir
+        self.glob_dirs = set()
+        self.config_symbols = {}
+        script_path = self.script_path / COLLECT_SCRIPT
+        logging.info(f"run script {script_path}")
+        # 同一进程多次收集时不重复添加
+        if self.script_path.as_posix() not in sys.path:
+            sys.path.append(self.script_path.as_posix())
+        self.collecting = True
+        try:
+            with profile.span(script_dir.name, "collect",
+                              path=script_dir.as_posix()):
+                exec(load_script(script_path, self.ctx.PROJECT_BUILD_PATH))
+        finally:
+            self.collecting = False
+
+    def collect_parallel(self, stale: list, cache: CollectCache,
+                         jobs: int) -> None:
+        """
+        在进程池中并行执行收集脚本，并按照串行执行时的顺序合并结果
+
+        :param stale: 需要执行收集脚本的组件文件夹
+        :param cache: 收集结果缓存
+        :param jobs: 并行的进程数
+        """
+        # 子进程只需要组件名和配置路径，不需要已经缓存的收集结果
+        skeleton = dict(self.build_env)
+        for kind in ("public_components", "user_components",
+                     "user_dirs", "public_port"):
+            skeleton[kind] = {name: self.new_env(Path(env["path"]))
+                              for name, env in self.build_env[kind].items()}
+        skeleton["user_main"] = self.new_env(
+            Path(self.build_env["user_main"]["path"]))
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(collect_worker, self.ctx, skeleton,
+                                       i.as_posix(), self.prune,
+                                       self.config_key)
+                       for i in stale]
+            for script_dir, future in zip(stale, futures):
+                result, glob_dirs, symbols, listings, events = \
+                    future.result()
+                profile.merge(events)
+                source_index.update(listings)
+                env = self.get_env(script_dir)
+                env.update(result)
+                cache.put(script_dir, env, glob_dirs, symbols)
+                self.config_usage[script_dir.name] = sorted(symbols)
 
     def collect(self,
                 srcs: list = ["*.c"],
                 inc_dirs: list = ["."],
                 requires: list = [],
                 cflags: list = [],
+                excludes: list = [],
                 ):
-        def deep_flatte(iterable):
-            result = []
-            stack = [iter(iterable)]
-
-            while stack:
-                current = stack[-1]
-                try:
-                    item = next(current)
-                    if isinstance(item, list):
-                        stack.append(iter(item))
-                    else:
-                        result.append(item)
-                except StopIteration:
-                    stack.pop()
+        """
+        收集组件的编译信息
 
-            return result
+        :param srcs: 源文件的 glob 规则，支持 **
+        :param inc_dirs: 头文件路径
+        :param requires: 依赖的组件
+        :param cflags: 组件的cflags
+        :param excludes: 从 srcs 中排除的 glob 规则
+        """
         script_path: Path = self.script_path
-        srcs = [list(script_path.glob(i)) for i in srcs]
-        srcs = deep_flatte(srcs)
+        with profile.span("glob", "glob", component=script_path.name):
+            srcs = source_index.glob(script_path, srcs, excludes,
+                                     self.glob_dirs)
         srcs = [i.as_posix() for i in srcs]
         inc_dirs = [(script_path / i).resolve().as_posix() for i in inc_dirs]
         inc_dirs.append(self.build_env["config_path"])  # 添加menuconfig生成的头文件
-        name: str = script_path.name
-        script_dir = script_path.parent
-        if name == "main":
-            self.build_env["user_main"]["srcs"].extend(srcs)
-            self.build_env["user_main"]["inc_dirs"].extend(inc_dirs)
-            self.build_env["user_main"]["requires"].extend(list(self.build_env["public_components"].keys(
-            ))+list(self.build_env["user_components"].keys())+list(self.build_env["user_dirs"].keys())+list(self.build_env["public_port"].keys()))
-            self.build_env["user_main"]["cflags"].extend(cflags)
-            # 去重
-            self.build_env["user_main"]["srcs"] = list(
-                set(self.build_env["user_main"]["srcs"]))
-            self.build_env["user_main"]["inc_dirs"] = list(
-                set(self.build_env["user_main"]["inc_dirs"]))
-            self.build_env["user_main"]["requires"] = list(
-                set(self.build_env["user_main"]["requires"]))
-            self.build_env["user_main"]["cflags"] = list(
-                set(self.build_env["user_main"]["cflags"]))
-        elif script_dir == ROOT_COMPONENTS:
-            self.build_env["public_components"][name]["srcs"].extend(srcs)
-            self.build_env["public_components"][name]["inc_dirs"].extend(
-                inc_dirs)
-            self.build_env["public_components"][name]["requires"].extend(
-                requires)
-            self.build_env["public_components"][name]["cflags"].extend(cflags)
-            # 去重
-            self.build_env["public_components"][name]["srcs"] = list(
-                set(self.build_env["public_components"][name]["srcs"]))
-            self.build_env["public_components"][name]["inc_dirs"] = list(
-                set(self.build_env["public_components"][name]["inc_dirs"]))
-            self.build_env["public_components"][name]["requires"] = list(
-                set(self.build_env["public_components"][name]["requires"]))
-            self.build_env["public_components"][name]["cflags"] = list(
-                set(self.build_env["public_components"][name]["cflags"]))
-        elif script_dir == PROJECT_COMPONENTS:
-            self.build_env["user_components"][name]["srcs"].extend(srcs)
-            self.build_env["user_components"][name]["inc_dirs"].extend(
-                inc_dirs)
-            self.build_env["user_components"][name]["requires"].extend(
-                requires)
-            self.build_env["user_components"][name]["cflags"].extend(cflags)
-            # 去重
-            self.build_env["user_components"][name]["srcs"] = list(
-                set(self.build_env["user_components"][name]["srcs"]))
-            self.build_env["user_components"][name]["inc_dirs"] = list(
-                set(self.build_env["user_components"][name]["inc_dirs"]))
-            self.build_env["user_components"][name]["requires"] = list(
-                set(self.build_env["user_components"][name]["requires"]))
-            self.build_env["user_components"][name]["cflags"] = list(
-                set(self.build_env["user_components"][name]["cflags"]))
-        elif script_dir == ROOT_PORT.parent:
-            self.build_env["public_port"][name]["srcs"].extend(srcs)
-            self.build_env["public_port"][name]["inc_dirs"].extend(inc_dirs)
-            self.build_env["public_port"][name]["requires"].extend(requires)
-            self.build_env["public_port"][name]["cflags"].extend(cflags)
-            # 去重
-            self.build_env["public_port"][name]["srcs"] = list(
-                set(self.build_env["public_port"][name]["srcs"]))
-            self.build_env["public_port"][name]["inc_dirs"] = list(
-                set(self.build_env["public_port"][name]["inc_dirs"]))
-            self.build_env["public_port"][name]["requires"] = list(
-                set(self.build_env["public_port"][name]["requires"]))
-            self.build_env["public_port"][name]["cflags"] = list(
-                set(self.build_env["public_port"][name]["cflags"]))
-        else:
-            self.build_env["user_dirs"][name]["srcs"].extend(srcs)
-            self.build_env["user_dirs"][name]["inc_dirs"].extend(inc_dirs)
-            self.build_env["user_dirs"][name]["requires"].extend(requires)
-            self.build_env["user_dirs"][name]["cflags"].extend(cflags)
-            # 去重
-            self.build_env["user_dirs"][name]["srcs"] = list(
-                set(self.build_env["user_dirs"][name]["srcs"]))
-            self.build_env["user_dirs"][name]["inc_dirs"] = list(
-                set(self.build_env["user_dirs"][name]["inc_dirs"]))
-            self.build_env["user_dirs"][name]["requires"] = list(
-                set(self.build_env["user_dirs"][name]["requires"]))
-            self.build_env["user_dirs"][name]["cflags"] = list(
-                set(self.build_env["user_dirs"][name]["cflags"]))
+        env = self.get_env(script_path)
+        if script_path.name == "main" and not self.prune:
+            requires = list(self.build_env["public_components"].keys()) + \
+                list(self.build_env["user_components"].keys()) + \
+                list(self.build_env["user_dirs"].keys()) + \
+                list(self.build_env["public_port"].keys())
+        # UniqueList 会按照插入顺序去重
+        env["srcs"].extend(srcs)
+        env["inc_dirs"].extend(inc_dirs)
+        env["requires"].extend(requires)
+        env["cflags"].extend(cflags)
 
     def get_define(self, define: str):
         """
@@ -295,6 +502,39 @@ class Project:
 
         :param define 获取到的宏定义的值
         """
-        config = MenuConfig(PROJECT_CONFIG_PATH,
-                            XF_TARGET_PATH, PROJECT_BUILD_PATH)
-        return config.get_macro(define)
+        snapshot = MenuConfig.load_snapshot(self.ctx, self.config_key)
+        value = snapshot.get_macro(define)
+        self.config_symbols[define] = value
+        return value
+
+
+def collect_worker(ctx: BuildContext, build_env: dict, script_dir: str,
+                   prune: bool, config_key: str) -> tuple:
+    """
+    在子进程中执行单个组件的收集脚本
+
+    :param ctx: 编译上下文
+    :param build_env: 只包含组件名的 build_env
+    :param script_dir: 组件文件夹
+    :param prune: 是否裁剪未被依赖的公共组件
+    :param config_key: menuconfig 快照的指纹
+    :return: 组件的收集结果，glob 过的文件夹，读取过的宏定义及其取值，文件夹索引，
+             性能分析记录的区间
+    """
+    from . import bind_project
+
+    project = Project(ctx=ctx)
+    project.build_env = build_env
+    project.prune = prune
+    project.config_key = config_key
+    bind_project(project)
+    script_dir = Path(script_dir)
+    start = profile.mark()
+    with use_context(ctx):
+        project.exec_collect(script_dir)
+    env = project.get_env(script_dir)
+    result = {key: list(env[key]) for key in CollectCache.ENV_KEYS}
+    glob_dirs = list(project.glob_dirs)
+    listings = source_index.export(glob_dirs)
+    return result, glob_dirs, dict(project.config_symbols), listings, \
+        profile.events_since(start)
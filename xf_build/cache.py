@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+from .env import BuildContext
+from .fileio import dump_json
+
+
+def file_stamp(path) -> list:
+    """
+    获取文件或文件夹的指纹（修改时间和大小），不存在时返回 None
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def hash_json(data) -> str:
+    """
+    计算可 json 序列化对象的哈希值
+    """
+    content = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def file_digest(path) -> str:
+    """
+    计算文件内容的哈希值，文件不存在时返回 None
+    """
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def config_files(ctx: BuildContext) -> list:
+    """
+    menuconfig 可能加载的配置文件，按照优先级排列
+    """
+    return [
+        ctx.XF_PROJECT_PATH / "xfconfig",
+        ctx.XF_PROJECT_PATH / "xfconfig.defaults",
+        ctx.XF_TARGET_PATH / "xfconfig.defaults",
+    ]
+
+
+def config_fingerprint(ctx: BuildContext, kconfig_filenames: list,
+                       env_vars: list) -> str:
+    """
+    计算影响 menuconfig 取值的所有输入的指纹：解析过的所有 Kconfig 文件
+    （包括 config.in 以及 XFKconfig 中 source 的文件）、使用到的配置文件、
+    Kconfig 中引用的环境变量以及目标路径
+
+    :param ctx: 编译上下文
+    :param kconfig_filenames: ConfigCache 记录的 Kconfig 文件
+    :param env_vars: Kconfig 中引用的环境变量
+    """
+    stamps = {}
+    for i in list(kconfig_filenames) + config_files(ctx):
+        i = Path(i).as_posix()
+        stamps[i] = file_stamp(i)
+    return hash_json([ctx.XF_TARGET_PATH.as_posix(), stamps,
+                      {i: os.environ.get(i) for i in sorted(env_vars)}])
+
+
+class CollectCache:
+    """
+    xf_collect.py 的收集结果缓存
+
+    每个组件记录其收集脚本、同目录下的 python 脚本、XFKconfig
+    以及 glob 时遍历过的文件夹的指纹，还有收集脚本读取过的宏及其取值。
+    指纹和这些宏的取值都未改变的组件直接复用上次的
+    srcs/inc_dirs/requires/cflags，不再重新执行脚本。
+    """
+
+    VERSION: int = 3
+    CACHE_NAME: str = "collect_cache.json"
+    ENV_KEYS: tuple = ("srcs", "inc_dirs", "requires", "cflags")
+
+    def __init__(self, path: Path, global_key: str, snapshot) -> None:
+        """
+        :param path: 缓存文件路径
+        :param global_key: 全局指纹（组件列表等），改变时所有缓存失效
+        :param snapshot: menuconfig 的快照，收集脚本读取过的宏取值改变时组件失效
+        """
+        self.path = path
+        self.global_key = global_key
+        self.snapshot = snapshot
+        self.components = {}
+        self.hits = 0
+        self.misses = 0
+        # 与缓存文件的内容不一致，需要保存
+        self.dirty = True
+
+        if not path.exists():
+            return
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            logging.debug(f"缓存损坏，忽略: {path}")
+            return
+        if cache.get("version") != self.VERSION:
+            return
+        if cache.get("global") != global_key:
+            logging.debug("组件列表改变，收集缓存失效")
+            return
+        self.components = cache.get("components", {})
+        self.dirty = False
+
+    def get(self, script_dir: Path):
+        """
+        获取组件的缓存结果，缓存失效时返回 None
+
+        :param script_dir: 组件文件夹
+        """
+        item = self.components.get(script_dir.as_posix())
+        if item is None:
+            self.misses += 1
+            return None
+        for symbol, value in item["symbols"].items():
+            if self.snapshot.get_macro(symbol) != value:
+                self.misses += 1
+                return None
+        for path, stamp in item["stamps"].items():
+            if file_stamp(path) != stamp:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return {key: list(item["env"][key]) for key in self.ENV_KEYS}
+
+    def symbols(self, script_dir: Path) -> list:
+        """
+        获取组件的收集脚本读取过的宏定义
+        """
+        item = self.components.get(script_dir.as_posix(), {})
+        return sorted(item.get("symbols", {}))
+
+    def put(self, script_dir: Path, env: dict, dirs, symbols: dict) -> None:
+        """
+        记录组件的收集结果
+
+        :param script_dir: 组件文件夹
+        :param env: 组件在 build_env 中的内容
+        :param dirs: glob 时遍历过的文件夹
+        :param symbols: 收集脚本读取过的 menuconfig 的宏 -> 读取到的取值
+        """
+        paths = [
+            script_dir,
+            script_dir / "XFKconfig",
+        ]
+        paths.extend(script_dir.glob("*.py"))
+        paths.extend(Path(i) for i in dirs)
+
+        stamps = {}
+        for i in paths:
+            i = i.as_posix()
+            stamps[i] = file_stamp(i)
+
+        self.components[script_dir.as_posix()] = {
+            "stamps": stamps,
+            "symbols": dict(symbols),
+            "env": {key: list(env[key]) for key in self.ENV_KEYS},
+        }
+        self.dirty = True
+
+    def save(self) -> None:
+        logging.debug(f"收集缓存: 命中 {self.hits}, 未命中 {self.misses}")
+        if not self.dirty:
+            return
+        cache = {
+            "version": self.VERSION,
+            "global": self.global_key,
+            "components": self.components,
+        }
+        dump_json(self.path, cache, indent=None)
+        self.dirty = False
+
+
+class ConfigCache:
+    """
+    menuconfig 取值的磁盘缓存
+
+    记录 kconfiglib 解析过的所有 Kconfig 文件、使用的配置文件以及目标路径，
+    它们的内容都没有改变时直接使用缓存的取值和头文件内容，不再解析 Kconfig。
+    文件先比较修改时间和大小，不一致时再比较内容的哈希值。
+    """
+
+    VERSION: int = 2
+    CACHE_NAME: str = "config_cache.json"
+
+    def __init__(self, path: Path) -> None:
+        """
+        :param path: 缓存文件路径
+        """
+        self.path = path
+
+    def load(self, ctx: BuildContext):
+        """
+        读取缓存，输入改变或缓存不存在时返回 None
+
+        :param ctx: 编译上下文
+        :return: {"values": 符号名 -> 取值, "header": 头文件内容,
+                  "sources": 符号名 -> 定义该符号的 Kconfig 文件,
+                  "kconfig_filenames": 解析过的 Kconfig 文件,
+                  "env_vars": Kconfig 中引用的环境变量}
+        """
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get("version") != self.VERSION:
+            return None
+        if cache.get("target") != ctx.XF_TARGET_PATH.as_posix():
+            return None
+        for name, value in cache.get("env", {}).items():
+            if os.environ.get(name) != value:
+                return None
+
+        files = cache.get("files", {})
+        for i in config_files(ctx):
+            if i.as_posix() not in files:
+                return None
+        refreshed = False
+        for path, saved in files.items():
+            stamp = file_stamp(path)
+            if saved is None or stamp is None:
+                if saved != stamp:
+                    return None
+                continue
+            if stamp == saved[:2]:
+                continue
+            # 修改时间改变但内容未变，例如重新检出代码
+            if file_digest(path) != saved[2]:
+                return None
+            files[path] = stamp + saved[2:]
+            refreshed = True
+        if refreshed:
+            dump_json(self.path, cache, indent=None)
+        result = {key: cache[key] for key in ("values", "header", "sources")}
+        result["kconfig_filenames"] = list(files)
+        result["env_vars"] = list(cache.get("env", {}))
+        return result
+
+    def save(self, ctx: BuildContext, filenames: list, env_vars,
+             snapshot: dict) -> None:
+        """
+        保存解析的结果
+
+        :param ctx: 编译上下文
+        :param filenames: kconfiglib 解析过的 Kconfig 文件
+        :param env_vars: Kconfig 中引用的环境变量
+        :param snapshot: 与 load 的返回值格式相同，不包括解析过的文件和环境变量
+        """
+        files = {}
+        for i in [Path(i).resolve() for i in filenames] + config_files(ctx):
+            i = i.as_posix()
+            stamp = file_stamp(i)
+            files[i] = None if stamp is None else stamp + [file_digest(i)]
+        cache = {
+            "version": self.VERSION,
+            "target": ctx.XF_TARGET_PATH.as_posix(),
+            "env": {i: os.environ.get(i) for i in sorted(env_vars)},
+            "files": files,
+        }
+        cache.update(snapshot)
+        dump_json(self.path, cache, indent=None)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+
+from .env import BuildContext, get_context
+from .fileio import parse_size
+
+# 编译缓存保存在 XF_ROOT/build/cc_cache 下
+CC_CACHE_DIR = "cc_cache"
+# 缓存大小上限，例如 512M、2G，默认 1G
+CC_CACHE_SIZE = "XF_CC_CACHE_SIZE"
+DEFAULT_CACHE_SIZE = 1 << 30
+# 缓存按哈希值的前两位分成 256 个桶，每个桶单独淘汰
+BUCKET_COUNT = 256
+
+SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".cxx", ".c++", ".m", ".S", ".s")
+# 后面跟着单独参数的选项
+OPTIONS_WITH_VALUE = ("-o", "-I", "-D", "-U", "-include", "-imacros",
+                      "-isystem", "-iquote", "-idirafter", "-iprefix",
+                      "-x", "-MF", "-MT", "-MQ", "-Xpreprocessor",
+                      "-Xassembler", "--param", "-arch", "-target")
+# 只影响依赖文件，不需要传给预处理
+DEPFILE_OPTIONS = ("-MD", "-MMD", "-MP")
+# 会产生额外输出或者结果不可复现的选项，直接调用编译器
+UNCACHEABLE_OPTIONS = ("-E", "-M", "-MM", "-save-temps", "-fprofile-arcs",
+                       "-ftest-coverage", "--coverage", "-gsplit-dwarf",
+                       "-fprofile-generate")
+
+
+class CompileCommand:
+    """
+    解析编译单个源文件的命令：compiler [flags] -c source -o object
+
+    :param compiler: 编译器
+    :param args: 编译器的参数
+    """
+
+    def __init__(self, compiler: str, args: list) -> None:
+        self.compiler = compiler
+        self.args = args
+        self.source = None
+        self.output = None
+        self.depfile = None
+        # 依赖文件中的目标名，-MT 和 -MQ 按出现的顺序记录
+        self.depfile_targets = []
+        self.cacheable = False
+        self.parse()
+
+    def parse(self) -> None:
+        sources = []
+        has_compile = False
+        has_depfile = False
+        skip = False
+        for i, arg in enumerate(self.args):
+            if skip:
+                skip = False
+                continue
+            if arg in OPTIONS_WITH_VALUE:
+                if i + 1 >= len(self.args):
+                    return
+                if arg == "-o":
+                    self.output = self.args[i + 1]
+                elif arg == "-MF":
+                    self.depfile = self.args[i + 1]
+                elif arg in ("-MT", "-MQ"):
+                    self.depfile_targets.append([arg, self.args[i + 1]])
+                skip = True
+            elif arg == "-c":
+                has_compile = True
+            elif arg in DEPFILE_OPTIONS[:2]:
+                has_depfile = True
+            elif arg in UNCACHEABLE_OPTIONS or arg.startswith("@") or \
+                    arg.startswith("-fprofile-") or arg == "-":
+                return
+            elif not arg.startswith("-") and arg.endswith(SOURCE_SUFFIXES):
+                sources.append(arg)
+
+        if not has_compile or len(sources) != 1:
+            return
+        self.source = sources[0]
+        if self.output is None:
+            self.output = Path(self.source).with_suffix(".o").name
+        if has_depfile and self.depfile is None:
+            self.depfile = Path(self.output).with_suffix(".d").as_posix()
+        elif not has_depfile:
+            # 只有 -MF 没有 -MD 时不生成依赖文件
+            self.depfile = None
+        self.cacheable = True
+
+    def preprocess_args(self) -> list:
+        """
+        预处理的参数：去掉 -c、-o 和依赖文件相关的选项，加上 -E
+        """
+        result = []
+        skip = False
+        for arg in self.args:
+            if skip:
+                skip = False
+                continue
+            if arg in ("-o", "-MF", "-MT", "-MQ"):
+                skip = True
+                continue
+            if arg == "-c" or arg in DEPFILE_OPTIONS:
+                continue
+            result.append(arg)
+        return [self.compiler] + result + ["-E"]
+
+    def outputs(self) -> dict:
+        """
+        缓存中的文件名 -> 编译产生的文件
+        """
+        result = {"object": self.output}
+        if self.depfile is not None:
+            result["depfile"] = self.depfile
+        return result
+
+
+class CompilerCache:
+    """
+    以内容寻址的编译结果缓存
+
+    缓存的键是编译器（路径、修改时间和大小）、编译参数、工作目录以及预处理后的源码的
+    sha256，源码包含的头文件（包括 xfconfig.h）改变时预处理结果随之改变。
+    每条缓存是一个文件夹，命中时更新修改时间，超出大小上限时淘汰最久没有使用的缓存。
+
+    :param path: 缓存文件夹
+    :param max_size: 缓存大小上限，单位字节
+    """
+
+    STATS_NAME: str = "stats.json"
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.path = Path(path)
+        self.max_size = max_size
+
+    @classmethod
+    def from_context(cls, ctx: BuildContext = None) -> "CompilerCache":
+        ctx = ctx or get_context()
+        max_size = DEFAULT_CACHE_SIZE
+        if os.environ.get(CC_CACHE_SIZE):
+            max_size = parse_size(os.environ[CC_CACHE_SIZE])
+        return cls(ctx.ROOT_BUILD_PATH / CC_CACHE_DIR, max_size)
+
+    @staticmethod
+    def compiler_identity(compiler: str) -> list:
+        path = shutil.which(compiler)
+        if path is None:
+            return [compiler]
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return [path, st.st_mtime_ns, st.st_size]
+
+    def digest(self, command: CompileCommand):
+        """
+        计算编译命令的缓存键，预处理失败时返回 None
+        """
+        # 目标文件的路径和 -MT/-MQ 只影响依赖文件的内容，没有依赖文件时不同路径可以共享缓存
+        outputs = command.outputs() if command.depfile is not None else {}
+        targets = command.depfile_targets if command.depfile is not None \
+            else []
+        h = hashlib.sha256()
+        h.update(json.dumps([self.compiler_identity(command.compiler),
+                             command.preprocess_args(), outputs, targets,
+                             os.getcwd()]).encode("utf-8"))
+        if command.source.endswith(".s"):
+            # 汇编文件不经过预处理
+            with open(command.source, "rb") as f:
+                h.update(f.read())
+            return h.hexdigest()
+        proc = subprocess.run(command.preprocess_args(),
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+        if proc.returncode != 0:
+            return None
+        h.update(proc.stdout)
+        return h.hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / key[2:]
+
+    def lookup(self, key: str, command: CompileCommand) -> bool:
+        """
+        命中时把缓存的文件复制到输出位置，复制时缓存被并发淘汰视为未命中
+        """
+        entry = self.entry_path(key)
+        outputs = command.outputs()
+        temps = {}
+        try:
+            # 先复制到临时文件，全部成功后再替换，不会留下一半新一半旧的输出
+            for name, target in outputs.items():
+                Path(target).parent.mkdir(parents=True, exist_ok=True)
+                temps[target] = f"{target}.{os.getpid()}.tmp"
+                shutil.copyfile(entry / name, temps[target])
+            stderr = entry / "stderr"
+            message = stderr.read_bytes() if stderr.exists() else b""
+        except OSError:
+            for temp in temps.values():
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+            return False
+        for target, temp in temps.items():
+            os.replace(temp, target)
+        if message:
+            sys.stderr.buffer.write(message)
+            sys.stderr.buffer.flush()
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key: str, command: CompileCommand, stderr: bytes) -> None:
+        """
+        保存编译结果，先写入临时文件夹再改名，并发编译不会读到不完整的缓存
+        """
+        entry = self.entry_path(key)
+        if entry.exists():
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        temp = entry.parent / f".{entry.name}.{os.getpid()}.tmp"
+        temp.mkdir()
+        try:
+            for name, source in command.outputs().items():
+                shutil.copyfile(source, temp / name)
+            if stderr:
+                (temp / "stderr").write_bytes(stderr)
+            os.rename(temp, entry)
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        self.evict(entry.parent)
+
+    def evict(self, bucket: Path) -> None:
+        """
+        桶的大小超过上限时，删除最久没有使用的缓存
+        """
+        limit = self.max_size // BUCKET_COUNT
+        entries = []
+        total = 0
+        for entry in bucket.iterdir():
+            if entry.name.startswith("."):
+                continue
+            try:
+                size = sum(i.stat().st_size for i in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+            total += size
+        if total <= limit:
+            return
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= limit * 0.8:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def count(self, name: str) -> None:
+        """
+        记录命中或未命中的次数，并发编译时通过文件锁互斥
+        """
+        try:
+            import fcntl
+        except ImportError:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / self.STATS_NAME, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                counts = json.loads(f.read() or "{}")
+            except ValueError:
+                counts = {}
+            counts[name] = counts.get(name, 0) + 1
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(counts))
+
+    def stats(self) -> dict:
+        """
+        统计缓存的条目数、大小以及命中次数
+        """
+        result = {"entries": 0, "size": 0, "hits": 0, "misses": 0,
+                  "max_size": self.max_size}
+        if not self.path.is_dir():
+            return result
+        try:
+            with open(self.path / self.STATS_NAME, encoding="utf-8") as f:
+                counts = json.load(f)
+            result["hits"] = counts.get("hits", 0)
+            result["misses"] = counts.get("misses", 0)
+        except (OSError, ValueError):
+            pass
+        for i in self.path.iterdir():
+            if i.is_dir():
+                for entry in i.iterdir():
+                    if entry.name.startswith("."):
+                        continue
+                    result["entries"] += 1
+                    result["size"] += sum(f.stat().st_size
+                                          for f in entry.iterdir())
+        return result
+
+    def clear(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def compile(self, compiler: str, args: list) -> int:
+        """
+        通过缓存编译，无法缓存的命令直接调用编译器
+
+        :param compiler: 编译器
+        :param args: 编译器的参数
+        :return: 编译器的返回值
+        """
+        command = CompileCommand(compiler, args)
+        if not command.cacheable:
+            return subprocess.call([compiler] + args)
+
+        key = self.digest(command)
+        if key is None:
+            return subprocess.call([compiler] + args)
+        if self.lookup(key, command):
+            logging.debug(f"编译缓存命中: {command.source}")
+            self.count("hits")
+            return 0
+
+        proc = subprocess.run([compiler] + args, stderr=subprocess.PIPE)
+        sys.stderr.buffer.write(proc.stderr)
+        sys.stderr.buffer.flush()
+        if proc.returncode == 0:
+            self.store(key, command, proc.stderr)
+        self.count("misses")
+        return proc.returncode
@@ -3,18 +3,13 @@
 import argparse
 import logging
 import sys
+import os
 
 
 from ..log import logging_setup
-from ..env import is_project
-from ..env import XF_ROOT
-from ..env import ROOT_PLUGIN
-from ..plugins import Plugins
 
-from . import project
-from .package import download_file
-from .package import remove_file
-from .package import search_by_name
+# 子命令依赖的模块（env、rich、requests、serial 等）在执行时才导入，
+# 避免 xf --help 等简单命令承担所有依赖库的导入时间
 
 
 def main():
@@ -31,6 +26,20 @@ def main():
     # build command
     build_parser = subparsers.add_parser('build',
                                          help="编译工程", aliases=['b'])
+    build_parser.add_argument('-j', '--jobs', type=int, default=None,
+                              help="并行执行收集脚本的进程数，批量编译时为同时编译的任务数")
+    build_parser.add_argument('-w', '--watch', action='store_true',
+                              help="监视文件修改并自动重新编译")
+    build_parser.add_argument('--targets', type=str, default=None,
+                              help="批量编译的目标，逗号分隔")
+    build_parser.add_argument('--projects', type=str, default=None,
+                              help="批量编译的工程路径，逗号分隔")
+    build_parser.add_argument('--profile', nargs='?', const="", default=None,
+                              metavar="PATH",
+                              help="记录各阶段和各组件的耗时，保存成 Chrome trace（默认为 build/profile.json）")
+    build_parser.add_argument('--explain', type=str, default=None,
+                              metavar="HEADER",
+                              help="收集后列出依赖该头文件的组件和源文件，不调用插件")
     build_parser.add_argument('args', nargs=argparse.REMAINDER, help="参数传递给插件")
 
     # clean command
@@ -75,6 +84,10 @@ def main():
                                 help="指定版本")
     install_parser.add_argument('-g', '--glob', action='store_true',
                                 help="安装到全局还是本地")
+    install_parser.add_argument('--offline', action='store_true',
+                                help="只从本机的组件缓存安装，不访问服务器")
+    install_parser.add_argument('--hardlink', action='store_true',
+                                help="不支持 reflink 时通过硬链接从缓存安装，而不是复制")
 
     # uninstall command
     uninstall_parser = subparsers.add_parser('uninstall', help="卸载指定的包")
@@ -106,6 +119,23 @@ def main():
     simulate_parser = subparsers.add_parser('simulate',
                                             help="模拟器运行", aliases=['sim'])
 
+    # daemon command
+    daemon_parser = subparsers.add_parser('daemon',
+                                          help="常驻进程：减少 xf 命令的启动时间")
+    daemon_parser.add_argument('action', choices=['start', 'stop', 'status'],
+                               help="启动、停止或查看常驻进程")
+
+    # cc-cache command
+    cc_cache_parser = subparsers.add_parser('cc-cache',
+                                            help="通过编译缓存调用编译器：xf cc-cache <编译器> <参数>")
+    cc_cache_parser.add_argument('-s', '--stats', action='store_true',
+                                 help="显示编译缓存的统计信息")
+    cc_cache_parser.add_argument('-C', '--clear', action='store_true',
+                                 help="清空编译缓存")
+    cc_cache_parser.add_argument('compiler', nargs='?', help="编译器")
+    cc_cache_parser.add_argument('args', nargs=argparse.REMAINDER,
+                                 help="编译器的参数")
+
     args = parser.parse_args()
 
     # Logging setup
@@ -114,11 +144,17 @@ def main():
     else:
         logging_setup(level=logging.INFO, rich=args.rich)
 
-    if XF_ROOT == "":
+    if args.command is None:
+        parser.print_help()
+        return
+
+    if not os.environ.get("XF_ROOT"):
         logging.error(
             "please run '. export.sh <target>' then run 'xf' command!")
         sys.exit("not have 'XF_ROOT' in your environ")
 
+    from . import project
+
     # Command execution
     if args.command == 'build' or args.command == "b":
         handle_build(args)
@@ -135,10 +171,14 @@ def main():
     elif args.command == 'update' or args.command == "u":
         handle_update(args)
     elif args.command == 'install' or args.command == "i":
-        download_file(args.name, args.version, args.glob)
+        from .package import download_file
+        download_file(args.name, args.version, args.glob,
+                      args.offline, args.hardlink)
     elif args.command == 'uninstall':
+        from .package import remove_file
         remove_file(args.name, args.glob)
     elif args.command == 'search' or args.command == "s":
+        from .package import search_by_name
         search_by_name(args.name)
     elif args.command == 'monitor' or args.command == "m":
         project.monitor(args.port, args.baud)
@@ -146,69 +186,128 @@ def main():
         handle_target(args)
     elif args.command == 'simulate' or args.command == "sim":
         project.simulate()
+    elif args.command == 'daemon':
+        handle_daemon(args)
+    elif args.command == 'cc-cache':
+        handle_cc_cache(args)
     else:
         parser.print_help()
 
 
+def get_hook():
+    from ..env import ROOT_PLUGIN
+    from ..plugins import Plugins
+
+    plugin = Plugins(ROOT_PLUGIN)
+    return plugin.get_hook()
+
+
 def handle_build(args):
-    project.build()
-    if args.test:
+    from ..env import BUILD_JOBS
+    from . import project
+
+    if args.targets or args.projects:
+        from ..batch import batch_build
+
+        def split(value):
+            return [i for i in (value or "").split(",") if i]
+
+        failed = batch_build(split(args.targets), split(args.projects),
+                             args.jobs, args.args, args.test)
+        if failed:
+            sys.exit(f"{failed} 个任务编译失败")
         return
-    plugin = Plugins(ROOT_PLUGIN)
 
-    hook = plugin.get_hook()
-    hook.build(args.args)
+    if args.jobs:
+        os.environ[BUILD_JOBS] = str(args.jobs)
+    if args.profile is not None:
+        from .. import profile
+        profile.enable()
+
+    def plugin_build():
+        if args.test:
+            return
+        from .. import profile
+        hook = get_hook()
+        with profile.span("plugin build"):
+            hook.build(args.args)
+
+    def report_profile():
+        if args.profile is None:
+            return
+        from .. import profile
+        project.report_profile(args.profile)
+        # watch 模式下每次编译单独记录
+        profile.enable()
+
+    if args.watch:
+        def watch_build():
+            plugin_build()
+            report_profile()
+
+        project.watch(watch_build)
+        return
+    if args.explain:
+        project.build()
+        project.explain(args.explain)
+        report_profile()
+        return
+    project.build()
+    plugin_build()
+    report_profile()
 
 
 def handle_clean(args):
+    from . import project
+
     project.clean()
     if args.test:
         return
-    plugin = Plugins(ROOT_PLUGIN)
-
-    hook = plugin.get_hook()
+    hook = get_hook()
     hook.clean(args.args)
 
 
 def handle_menuconfig(args):
+    from . import project
+
     if len(args.args) == 0:
         project.menuconfig()
     else:
-        plugin = Plugins(ROOT_PLUGIN)
-
-        hook = plugin.get_hook()
+        hook = get_hook()
         hook.menuconfig(args.args)
 
 
 def handle_flash(args):
-    is_project(".")
-    plugin = Plugins(ROOT_PLUGIN)
+    from ..env import is_project
 
-    hook = plugin.get_hook()
+    is_project(".")
+    hook = get_hook()
     hook.flash(args.args)
 
 
 def handle_export(args):
+    from . import project
+
     name_abspath = project.before_export(args.name)
     if args.test:
         return
-    plugin = Plugins(ROOT_PLUGIN)
-
-    hook = plugin.get_hook()
+    hook = get_hook()
     hook.export(name_abspath, args.args)
 
 
 def handle_update(args):
+    from . import project
+
     name_abspath = project.before_update(args.name)
     if args.test:
         return
-    plugin = Plugins(ROOT_PLUGIN)
-
-    hook = plugin.get_hook()
+    hook = get_hook()
     hook.update(name_abspath, args.args)
 
 
 def handle_target(args):
+    from . import project
+
     logging.info(f"args: {args}")
     if args.download and not args.show:
         project.download_sdk()
@@ -216,5 +315,40 @@ def handle_target(args):
         project.show_target()
 
 
+def handle_daemon(args):
+    from .. import daemon
+    from ..env import XF_ROOT
+
+    if args.action == "start":
+        daemon.start(XF_ROOT.as_posix())
+    elif args.action == "stop":
+        daemon.stop(XF_ROOT.as_posix())
+    elif daemon.status(XF_ROOT.as_posix()):
+        logging.info(f"常驻进程运行中: {daemon.socket_path(XF_ROOT.as_posix())}")
+    else:
+        logging.info("常驻进程没有运行")
+
+
+def handle_cc_cache(args):
+    from ..cc_cache import CompilerCache
+
+    cache = CompilerCache.from_context()
+    if args.clear:
+        cache.clear()
+        logging.info(f"已清空编译缓存: {cache.path}")
+    if args.stats:
+        stats = cache.stats()
+        total = stats["hits"] + stats["misses"]
+        rate = stats["hits"] / total * 100 if total else 0
+        logging.info(f"编译缓存: {cache.path}")
+        logging.info(f"条目: {stats['entries']}, "
+                     f"大小: {stats['size'] / (1 << 20):.1f} MiB / "
+                     f"{stats['max_size'] / (1 << 20):.0f} MiB")
+        logging.info(f"命中: {stats['hits']}, 未命中: {stats['misses']}, "
+                     f"命中率: {rate:.1f}%")
+    if args.compiler:
+        sys.exit(cache.compile(args.compiler, args.args))
+
+
 if __name__ == "__main__":
     main()
@@ -4,17 +4,28 @@ import logging
 from pathlib import Path
 import hashlib
 from zipfile import ZipFile
-import io
+import os
 import shutil
+import tempfile
 from rich.console import Console
 from rich.table import Table
 from rich.progress import Progress
 
 from ..env import ROOT_COMPONENTS, PROJECT_COMPONENTS
+from ..fileio import parse_size
 
 HOST = "https://server1.ptwsmart.com:31300"
 SEARCH_API = "{HOST}/api/component/search/{keywords}"
 INSTALL_API = "{HOST}/api/component/download/{name}:{version}.zip"
+# 下载时每次读取的大小
+CHUNK_SIZE = 1024 * 1024
+# 组件缓存的路径，默认为 ~/.cache/xf
+CACHE_PATH = "XF_CACHE_PATH"
+# 组件缓存的大小上限，例如 512M、2G，默认 2G
+CACHE_SIZE = "XF_CACHE_SIZE"
+DEFAULT_CACHE_SIZE = 2 << 30
+# linux 的 FICLONE ioctl
+FICLONE = 0x40049409
 
 
 class ComponentNotFoundError(Exception):
@@ -25,6 +36,214 @@ class ComponentBroken(Exception):
     pass
 
 
+class ComponentCache:
+    """
+    本机的组件缓存，多个工程共用
+
+    以服务器提供的 file_hash 为键保存解压后的组件，index.json 记录 名称:版本 -> file_hash。
+    安装时优先使用 reflink（写时复制），不支持时复制。硬链接需要显式开启，
+    此时工程中的文件与缓存共用同一份数据，缓存中的文件是只读的，避免直接修改时改坏缓存。
+    超过大小上限时按最近使用时间淘汰。
+
+    :param path: 缓存文件夹
+    :param max_size: 缓存大小上限，单位字节
+    """
+
+    INDEX_NAME: str = "index.json"
+    OBJECTS_DIR: str = "objects"
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.path = Path(path)
+        self.max_size = max_size
+        self.objects = self.path / self.OBJECTS_DIR
+
+    @classmethod
+    def from_environ(cls) -> "ComponentCache":
+        path = os.environ.get(CACHE_PATH)
+        if path:
+            path = Path(path)
+        else:
+            path = Path.home() / ".cache" / "xf"
+        max_size = DEFAULT_CACHE_SIZE
+        if os.environ.get(CACHE_SIZE):
+            max_size = parse_size(os.environ[CACHE_SIZE])
+        return cls(path / "components", max_size)
+
+    def load_index(self) -> dict:
+        try:
+            with (self.path / self.INDEX_NAME).open("r",
+                                                   encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_index(self, index: dict) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path / f".{self.INDEX_NAME}.{os.getpid()}.tmp"
+        with temp_path.open("w", encoding="utf-8") as f:
+            json.dump(index, f, indent=4)
+        os.replace(temp_path, self.path / self.INDEX_NAME)
+
+    def record(self, name: str, version, file_hash: str) -> None:
+        index = self.load_index()
+        index[f"{name}:{version or 'last'}"] = file_hash
+        self.save_index(index)
+
+    def resolve(self, name: str, version=None):
+        """
+        离线时根据名称和版本查找缓存，没有指定版本时使用最近一次安装的最新版本，
+        没有时使用最近使用过的版本
+
+        :return: file_hash，缓存中没有时返回 None
+        """
+        index = self.load_index()
+        candidates = [index.get(f"{name}:{version or 'last'}")]
+        if version is None:
+            prefix = f"{name}:"
+            others = [i for key, i in index.items() if key.startswith(prefix)]
+            others.sort(key=lambda i: self.last_used(i), reverse=True)
+            candidates.extend(others)
+        for file_hash in candidates:
+            if file_hash is not None and self.has(file_hash):
+                return file_hash
+        return None
+
+    def has(self, file_hash: str) -> bool:
+        return (self.objects / file_hash).is_dir()
+
+    def last_used(self, file_hash: str) -> float:
+        try:
+            return (self.objects / file_hash).stat().st_mtime
+        except OSError:
+            return 0
+
+    def add(self, file_hash: str, archive_path: Path) -> None:
+        """
+        把校验过的压缩包解压到缓存中，先解压到临时文件夹再改名
+        """
+        if self.has(file_hash):
+            return
+        self.objects.mkdir(parents=True, exist_ok=True)
+        temp_path = Path(tempfile.mkdtemp(prefix=f".{file_hash}.",
+                                          dir=self.objects))
+        try:
+            decompress_zip_file(temp_path, archive_path)
+            for root, _, files in os.walk(temp_path):
+                for i in files:
+                    path = os.path.join(root, i)
+                    os.chmod(path, os.stat(path).st_mode & ~0o222)
+            os.rename(temp_path, self.objects / file_hash)
+        except OSError:
+            if not self.has(file_hash):
+                raise
+        finally:
+            if temp_path.exists():
+                shutil.rmtree(temp_path, onerror=_remove_readonly)
+        self.evict(keep=file_hash)
+
+    def install(self, file_hash: str, target: Path,
+                hardlink: bool = False) -> str:
+        """
+        从缓存安装到 target，target 必须不存在
+
+        :param hardlink: reflink 不可用时使用硬链接，而不是复制
+        :return: 使用的方式：reflink、hardlink 或 copy
+        """
+        source = self.objects / file_hash
+        os.utime(source)
+        methods = set()
+
+        def link_file(src, dst):
+            methods.add(link_or_copy(src, dst, hardlink))
+
+        shutil.copytree(source, target, copy_function=link_file)
+        if not methods:
+            return "copy"
+        return "copy" if "copy" in methods else methods.pop()
+
+    def size(self, path: Path) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            for i in files:
+                try:
+                    total += os.lstat(os.path.join(root, i)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self, keep: str = None) -> None:
+        """
+        缓存超过大小上限时，删除最久没有使用的组件
+        """
+        entries = []
+        total = 0
+        for entry in self.objects.iterdir():
+            if entry.name.startswith("."):
+                continue
+            size = self.size(entry)
+            entries.append((self.last_used(entry.name), size, entry))
+            total += size
+        entries.sort()
+        removed = []
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, onerror=_remove_readonly)
+            removed.append(entry.name)
+            total -= size
+        if removed:
+            index = self.load_index()
+            self.save_index({key: i for key, i in index.items()
+                             if i not in removed})
+            logging.debug(f"组件缓存淘汰: {', '.join(removed)}")
+
+
+def _remove_readonly(func, path, _):
+    os.chmod(path, 0o700)
+    func(path)
+
+
+def link_or_copy(src: str, dst: str, hardlink: bool = False) -> str:
+    """
+    依次尝试 reflink、硬链接（需要开启）和复制，不同的文件系统之间只能复制
+
+    :return: 使用的方式
+    """
+    if reflink(src, dst):
+        return "reflink"
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    os.chmod(dst, os.stat(src).st_mode | 0o200)
+    return "copy"
+
+
+def reflink(src: str, dst: str) -> bool:
+    """
+    写时复制（btrfs、xfs 等），不支持时返回 False
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, "rb") as fsrc:
+        try:
+            with open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            return False
+    os.chmod(dst, os.stat(src).st_mode | 0o200)
+    return True
+
+
 def search_component(name: str):
     res = requests.get(SEARCH_API.format(HOST=HOST, keywords=name))
     if res.status_code == 200:
@@ -51,60 +270,114 @@ def search_by_name(name: str):
     console.print(table)
 
 
-def download_component(name: str, version):
+def component_info(name: str, version):
+    """
+    查询组件的下载地址和 sha256
+
+    :param name: 组件名
+    :param version: 版本，默认为最新版本
+    :return: (下载地址, sha256)
+    """
     _version = version if version else "last"
     res = requests.get(INSTALL_API.format(
         HOST=HOST, name=name, version=_version))
     if res.status_code != 200:
         res.raise_for_status()
     data = json.loads(res.content.decode())
-    file_url = data["url"]
-    check_sum = data["file_hash"]
+    return data["url"], data["file_hash"]
+
 
+def download_component(name: str, file_url: str, archive) -> str:
+    """
+    下载组件的压缩包，边下载边写入文件并计算 sha256
+
+    :param name: 组件名
+    :param file_url: 下载地址
+    :param archive: 以二进制方式打开的文件
+    :return: 下载内容的 sha256
+    """
+    hasher = hashlib.sha256()
     with requests.get(file_url, stream=True) as response:
         if response.status_code == 404:
             raise ComponentNotFoundError(
                 f"Can't find component {name}"
             )
+        response.raise_for_status()
         total_size = int(response.headers.get('content-length', 0))
-        block_size = 1024  # 1 Kibibyte
         progress = Progress()
-        task = progress.add_task("Downloading...", total=total_size)
+        task = progress.add_task("Downloading...", total=total_size or None)
 
-        content = b""
         with progress:
-            for data in response.iter_content(block_size):
+            for data in response.iter_content(CHUNK_SIZE):
+                hasher.update(data)
+                archive.write(data)
                 progress.update(task, advance=len(data))
-                content += data
-    return content, check_sum
+    return hasher.hexdigest()
 
 
-def calculate_zip_hash(content):
-    hasher = hashlib.sha256()
-    hasher.update(content)
-    return hasher.hexdigest()
+def decompress_zip_file(extract_path, archive_path):
+    with ZipFile(archive_path) as zip_file:
+        zip_file.extractall(path=extract_path)
 
 
-def decompress_zip_response(extract_path, content):
-    with ZipFile(io.BytesIO(content)) as zip_file:
-        for member in zip_file.namelist():
-            zip_file.extract(member, path=extract_path)
+def fetch_component(cache: ComponentCache, name: str, version,
+                    offline: bool = False) -> str:
+    """
+    确保组件在缓存中，sha256 与服务器一致的组件不再下载
 
+    :param offline: 只使用缓存，不访问服务器
+    :return: 组件的 file_hash
+    """
+    if offline:
+        file_hash = cache.resolve(name, version)
+        if file_hash is None:
+            raise ComponentNotFoundError(
+                f"组件{name}:{version or 'last'}不在缓存中: {cache.path}")
+        logging.info(f"使用缓存的组件{name}")
+        return file_hash
+
+    file_url, check_sum = component_info(name, version)
+    if cache.has(check_sum):
+        logging.info(f"使用缓存的组件{name}")
+    else:
+        cache.objects.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix=f".{name}.",
+                                         dir=cache.objects) as temp_dir:
+            archive_path = Path(temp_dir) / f"{name}.zip"
+            with archive_path.open("wb") as archive:
+                file_hash = download_component(name, file_url, archive)
+            logging.debug(f"file_hash:{file_hash}")
+            logging.debug(f"check_sum:{check_sum}")
+            if file_hash != check_sum:
+                raise ComponentBroken(f"The component {name} is invalid")
+            cache.add(check_sum, archive_path)
+    cache.record(name, version, check_sum)
+    return check_sum
 
-def download_file(name: str, version=None, glob=False):
+
+def download_file(name: str, version=None, glob=False, offline=False,
+                  hardlink=False):
     extract_path = Path(ROOT_COMPONENTS if glob else PROJECT_COMPONENTS)
     extract_path = extract_path / name
     if extract_path.exists():
         logging.error(f"组件{name}已存在")
         return
 
-    content, check_sum = download_component(name=name, version=version)
-    file_hash = calculate_zip_hash(content)
-    logging.debug(f"file_hash:{file_hash}")
-    logging.debug(f"check_sum:{check_sum}")
-    if file_hash != check_sum:
-        raise ComponentBroken(f"The component {name} is invalid")
-    decompress_zip_response(extract_path, content)
+    cache = ComponentCache.from_environ()
+    file_hash = fetch_component(cache, name, version, offline)
+
+    # 先安装到同一个文件夹下的临时文件夹再改名，失败时不会留下不完整的组件
+    extract_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=f".{name}.",
+                                     dir=extract_path.parent) as temp_dir:
+        staging_path = Path(temp_dir) / name
+        method = cache.install(file_hash, staging_path, hardlink)
+        try:
+            os.rename(staging_path, extract_path)
+        except OSError:
+            logging.error(f"组件{name}已存在")
+            return
+    logging.debug(f"从缓存安装: {method}")
     logging.info(f"组件{name}安装成功")
 
 
@@ -112,5 +385,6 @@ def remove_file(name, glob=False):
     file_path: Path = Path(ROOT_COMPONENTS if glob else PROJECT_COMPONENTS)
     file_path = file_path / name
     if file_path.exists():
-        shutil.rmtree(file_path)
+        # 从缓存安装的文件可能是只读的，windows 下需要先去掉只读属性才能删除
+        shutil.rmtree(file_path, onerror=_remove_readonly)
         logging.info(f"组件{name}移除成功")
@@ -3,30 +3,102 @@ import logging
 import shutil
 from pathlib import Path
 import os
-from rich.panel import Panel
-from rich.text import Text
-from rich.console import Console
-from art import text2art
 import json
 
-from ..menuconfig import MenuConfig
 from ..env import is_project
 from ..env import run_build
 from ..env import clean_project_build
 from ..env import ENTER_SCRIPT, EXPORT_SCRIPT
 from ..env import ROOT_TEMPLATE_PATH, XF_ROOT
-from ..env import PROJECT_CONFIG_PATH, PROJECT_BUILD_PATH
+from ..env import PROJECT_BUILD_PATH
 from ..env import XF_TARGET, XF_TARGET_PATH
-
-from serial.tools.miniterm import Miniterm
-import serial
+from ..env import XF_PROJECT_PATH, ROOT_BOARDS, ROOT_COMPONENTS, ROOT_PORT
+from ..watch import create_watcher
+from ..loader import purge_modules
 
 
 def build():
     is_project(".")
 
     logging.info("run build")
-    run_build()
+    from .. import profile
+    with profile.span("build"):
+        run_build()
+
+
+def watch(on_build):
+    """
+    监视工程和组件的修改，修改后重新收集并调用插件编译。
+    进程常驻，解析过的 menuconfig 和文件夹索引在多次编译之间复用，
+    收集缓存保证只有受影响的组件会重新执行收集脚本。
+    每次编译前移除从工程和组件文件夹导入的模块，修改过的脚本会重新加载。
+
+    :param on_build: 收集完成后调用插件编译
+    """
+    is_project(".")
+    roots = [
+        (XF_PROJECT_PATH, True),
+        (ROOT_COMPONENTS, True),
+        (ROOT_PORT, True),
+        (XF_ROOT, False),
+        (ROOT_BOARDS, False),
+        (XF_TARGET_PATH, False),
+    ]
+    watcher = create_watcher(roots, [PROJECT_BUILD_PATH])
+    logging.info(f"watch mode: {type(watcher).__name__}")
+    try:
+        while True:
+            purge_modules([i for i, recursive in roots if recursive])
+            try:
+                build()
+                on_build()
+            except Exception as e:
+                logging.error(f"编译失败: {e}")
+            logging.info("等待文件修改，按 Ctrl+C 退出")
+            changed = watcher.wait()
+            for i in changed[:10]:
+                logging.info(f"文件修改: {i}")
+            if len(changed) > 10:
+                logging.info(f"等 {len(changed)} 个文件")
+    except KeyboardInterrupt:
+        logging.info("退出 watch 模式")
+    finally:
+        watcher.close()
+
+
+def report_profile(path):
+    """
+    保存性能分析的 trace，并打印最慢的组件
+
+    :param path: trace 的保存路径，为空时保存到工程的 build 文件夹下
+    """
+    from .. import profile
+
+    profile.report(path or PROJECT_BUILD_PATH / profile.TRACE_NAME)
+
+
+def explain(header):
+    """
+    列出依赖该头文件的组件和源文件，用于判断修改头文件会影响哪些组件
+    """
+    from rich.console import Console
+    from rich.table import Table
+    from ..includes import IncludeIndex
+
+    index = IncludeIndex.load_project()
+    matched = index.match(header)
+    if not matched:
+        logging.warning(f"没有源文件依赖 {header}")
+        return
+    dependents = index.dependents(header)
+    table = Table(title=f"依赖 {', '.join(matched)} 的源文件")
+    table.add_column("组件", style="cyan")
+    table.add_column("源文件", style="magenta")
+    for component, srcs in sorted(dependents.items()):
+        table.add_row(component, "\n".join(srcs))
+    Console().print(table)
+    logging.info(f"{len(dependents)} 个组件, "
+                 f"{sum(len(i) for i in dependents.values())} 个源文件")
 
 
 def clean():
@@ -35,10 +107,11 @@ def clean():
 
 
 def menuconfig():
+    from ..menuconfig import MenuConfig
+
     is_project(".")
     run_build()
-    config = MenuConfig(PROJECT_CONFIG_PATH,
-                        XF_TARGET_PATH, PROJECT_BUILD_PATH)
+    config = MenuConfig.from_context()
     config.start()
 
 
@@ -117,6 +190,9 @@ def before_update(name):
 
 
 def monitor(port, baud=115200):
+    from serial.tools.miniterm import Miniterm
+    import serial
+
     if os.linesep == "\r\n":
         linesep = "crlf"
     else:
@@ -135,6 +211,11 @@ def monitor(port, baud=115200):
 
 
 def show_target():
+    from rich.panel import Panel
+    from rich.text import Text
+    from rich.console import Console
+    from art import text2art
+
     console = Console()
 
     # 创建彩色文本
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+# 常驻进程：预先导入依赖库，通过 unix socket 为 xf 命令提供服务
+# 注意：该模块作为 xf 命令的入口，不能在模块级别导入 env 等模块
+
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+
+# 可以转发给常驻进程执行的命令，常驻进程中命令的标准输入为 /dev/null，
+# 需要交互的命令（例如插件的 menuconfig）只能在当前进程执行
+SERVED_COMMANDS = ("build", "b", "clean", "c", "export", "e",
+                   "update", "u", "cc-cache")
+# 只在 xf 命令自身的参数中出现的选项
+GLOBAL_OPTIONS = ("-v", "--verbose", "-r", "--rich", "-t", "--test")
+# 常驻进程预先导入的依赖库
+PRELOAD_MODULES = ("jinja2", "kconfiglib", "menuconfig", "requests",
+                   "rich.console", "rich.table", "rich.progress",
+                   "rich.panel", "rich.logging", "art",
+                   "serial", "serial.tools.miniterm")
+# 设置该环境变量后不再转发给常驻进程
+NO_DAEMON = "XF_NO_DAEMON"
+
+# 帧类型
+FRAME_REQUEST = b"r"
+FRAME_STDOUT = b"o"
+FRAME_STDERR = b"e"
+FRAME_EXIT = b"x"
+_FRAME = struct.Struct("<cI")
+
+
+def socket_dir(xf_root: str) -> str:
+    """
+    socket 所在的文件夹，优先使用 XDG_RUNTIME_DIR，否则使用 XF_ROOT/build/daemon
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "xf")
+    return os.path.join(Path(xf_root).resolve().as_posix(), "build", "daemon")
+
+
+def socket_path(xf_root: str) -> str:
+    """
+    每个 XF_ROOT 对应一个常驻进程的 socket 路径
+    """
+    root = Path(xf_root).resolve().as_posix()
+    digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(socket_dir(xf_root), f"xf-{digest}.sock")
+
+
+def is_private(path: str) -> bool:
+    """
+    文件或文件夹是否属于当前用户，并且其他用户没有访问权限
+    """
+    if not hasattr(os, "getuid"):
+        return False
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and stat.S_IMODE(st.st_mode) & 0o077 == 0
+
+
+def peer_uid(sock: socket.socket):
+    """
+    socket 对端进程的 uid，平台不支持 SO_PEERCRED 时返回 None
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def send_frame(sock: socket.socket, kind: bytes, payload: bytes) -> None:
+    sock.sendall(_FRAME.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("xf daemon closed the connection")
+        data += chunk
+    return data
+
+
+def recv_frame(sock: socket.socket) -> tuple:
+    kind, size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    return kind, _recv_exact(sock, size)
+
+
+def served_command(argv: list) -> bool:
+    """
+    判断命令是否可以转发给常驻进程
+    """
+    args = [i for i in argv if i not in GLOBAL_OPTIONS]
+    return bool(args) and args[0] in SERVED_COMMANDS
+
+
+def connect(xf_root: str):
+    """
+    连接常驻进程，socket 或其所在的文件夹不属于当前用户时不连接，
+    请求中包含环境变量，不能发送给其他用户的进程
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path(xf_root)
+    if not is_private(os.path.dirname(path)) or not os.path.exists(path):
+        return None
+    if os.stat(path).st_uid != os.getuid():
+        logging.warning(f"socket 不属于当前用户，忽略: {path}")
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        uid = peer_uid(sock)
+    except OSError:
+        sock.close()
+        return None
+    if uid is not None and uid != os.getuid():
+        logging.warning(f"常驻进程不属于当前用户，忽略: {path}")
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock: socket.socket, kind: str, argv: list = []) -> int:
+    """
+    发送请求并把输出转发到当前终端
+
+    :return: 命令的返回值
+    """
+    message = {
+        "kind": kind,
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+    }
+    send_frame(sock, FRAME_REQUEST, json.dumps(message).encode("utf-8"))
+    while True:
+        frame, payload = recv_frame(sock)
+        if frame == FRAME_STDOUT:
+            sys.stdout.buffer.write(payload)
+            sys.stdout.buffer.flush()
+        elif frame == FRAME_STDERR:
+            sys.stderr.buffer.write(payload)
+            sys.stderr.buffer.flush()
+        elif frame == FRAME_EXIT:
+            return int(payload)
+
+
+def forward(argv: list):
+    """
+    把命令转发给常驻进程执行
+
+    :param argv: xf 的命令行参数
+    :return: 命令的返回值，没有常驻进程或命令不支持转发时返回 None
+    """
+    xf_root = os.environ.get("XF_ROOT")
+    if not xf_root or os.environ.get(NO_DAEMON):
+        return None
+    if not served_command(argv):
+        return None
+    sock = connect(xf_root)
+    if sock is None:
+        return None
+    with sock:
+        return request(sock, "run", argv)
+
+
+def main():
+    """
+    xf 命令的入口，有常驻进程时转发执行，否则在当前进程中执行
+    """
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    from .cmd.cmd import main as cmd_main
+    cmd_main()
+
+
+def _run_command(message: dict) -> int:
+    """
+    在 fork 出的子进程中执行 xf 命令
+    """
+    os.chdir(message["cwd"])
+    os.environ.clear()
+    os.environ.update(message["env"])
+    sys.argv = ["xf"] + message["argv"]
+
+    # xf_build 的模块在导入时解析环境变量，每次执行都需要重新导入
+    for name in list(sys.modules):
+        if name == "xf_build" or name.startswith("xf_build."):
+            del sys.modules[name]
+    logging.getLogger().handlers.clear()
+
+    try:
+        from xf_build.cmd.cmd import main as cmd_main
+        cmd_main()
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _handle(sock: socket.socket) -> None:
+    import signal
+    import selectors
+
+    # 只为同一用户的 xf 命令提供服务
+    uid = peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        return
+    kind, payload = recv_frame(sock)
+    message = json.loads(payload.decode("utf-8"))
+    if message["kind"] == "ping":
+        send_frame(sock, FRAME_EXIT, b"0")
+        return
+    if message["kind"] == "stop":
+        send_frame(sock, FRAME_EXIT, b"0")
+        os.kill(os.getppid(), signal.SIGTERM)
+        return
+
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        sock.close()
+        os.close(out_r)
+        os.close(err_r)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        code = 1
+        try:
+            code = _run_command(message)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    os.close(out_w)
+    os.close(err_w)
+
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ, FRAME_STDOUT)
+    selector.register(err_r, selectors.EVENT_READ, FRAME_STDERR)
+    try:
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 64 * 1024)
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    continue
+                send_frame(sock, key.data, data)
+    except OSError:
+        # 客户端断开（例如 Ctrl+C），结束正在执行的命令
+        os.killpg(pid, signal.SIGTERM)
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        code = 128 + os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+    try:
+        send_frame(sock, FRAME_EXIT, str(code).encode())
+    except OSError:
+        pass
+
+
+def serve(xf_root: str) -> None:
+    """
+    启动常驻进程，为同一个 XF_ROOT 下的 xf 命令提供服务
+    """
+    import signal
+    import importlib
+    import socketserver
+
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self) -> None:
+            _handle(self.request)
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    path = socket_path(xf_root)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.stat(directory).st_uid == os.getuid():
+        os.chmod(directory, 0o700)
+    if not is_private(directory):
+        raise SystemExit(f"{directory} 不属于当前用户或其他用户可以访问")
+    if os.path.exists(path):
+        os.remove(path)
+    old_umask = os.umask(0o077)
+    server = Server(path, Handler)
+    os.umask(old_umask)
+
+    def on_sigterm(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def start(xf_root: str) -> bool:
+    """
+    在后台启动常驻进程
+
+    :return: 是否启动成功
+    """
+    import time
+
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "fork"):
+        logging.error("当前平台不支持常驻进程")
+        return False
+    if status(xf_root):
+        logging.info("常驻进程已经在运行")
+        return True
+    log_path = Path(socket_path(xf_root)).with_suffix(".log")
+    log_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with open(log_path, "ab") as log:
+        subprocess.Popen([sys.executable, "-m", "xf_build.daemon", xf_root],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         start_new_session=True)
+    for _ in range(100):
+        if status(xf_root):
+            logging.info(f"常驻进程已启动: {socket_path(xf_root)}")
+            return True
+        time.sleep(0.05)
+    logging.error(f"常驻进程启动失败，请查看日志: {log_path}")
+    return False
+
+
+def stop(xf_root: str) -> None:
+    sock = connect(xf_root)
+    if sock is None:
+        logging.info("常驻进程没有运行")
+        return
+    with sock:
+        request(sock, "stop")
+    logging.info("常驻进程已停止")
+
+
+def status(xf_root: str) -> bool:
+    sock = connect(xf_root)
+    if sock is None:
+        return False
+    with sock:
+        try:
+            return request(sock, "ping") == 0
+        except (OSError, ConnectionError):
+            return False
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1])
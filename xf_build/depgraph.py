@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# main 在依赖图中的名称
+MAIN = "main"
+
+COMPONENT_KINDS = ("public_port", "public_components",
+                   "user_components", "user_dirs")
+
+
+class ComponentCycleError(Exception):
+    pass
+
+
+class ComponentMissingError(Exception):
+    pass
+
+
+class DependencyGraph:
+    """
+    由 build_env 中各组件的 requires 建立的依赖图
+    """
+
+    def __init__(self, build_env: dict) -> None:
+        self.kinds = {}
+        self.requires = {}
+        for kind in COMPONENT_KINDS:
+            for name, env in build_env[kind].items():
+                self.kinds[name] = kind
+                self.requires[name] = list(env["requires"])
+        self.kinds[MAIN] = "user_main"
+        self.requires[MAIN] = list(build_env["user_main"].get("requires", []))
+
+    def names(self, kind: str) -> list:
+        return [name for name, i in self.kinds.items() if i == kind]
+
+    def missing(self) -> list:
+        """
+        查找不存在的依赖
+
+        :return: [(组件名, 不存在的依赖名), ...]
+        """
+        return [(name, dep) for name, deps in self.requires.items()
+                for dep in deps if dep not in self.requires]
+
+    def find_cycle(self) -> list:
+        """
+        查找循环依赖
+
+        :return: 组成环的组件名，首尾相同；没有环时返回 None
+        """
+        WHITE, GRAY, BLACK = 0, 1, 2
+        color = dict.fromkeys(self.requires, WHITE)
+        for start in self.requires:
+            if color[start] != WHITE:
+                continue
+            path = [start]
+            stack = [iter(self.requires[start])]
+            color[start] = GRAY
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    color[path.pop()] = BLACK
+                    stack.pop()
+                    continue
+                if dep not in color:
+                    continue
+                if color[dep] == GRAY:
+                    return path[path.index(dep):] + [dep]
+                if color[dep] == WHITE:
+                    color[dep] = GRAY
+                    path.append(dep)
+                    stack.append(iter(self.requires[dep]))
+        return None
+
+    def check(self) -> None:
+        """
+        检查依赖图，存在循环依赖或依赖不存在时报错
+        """
+        cycle = self.find_cycle()
+        if cycle is not None:
+            raise ComponentCycleError(
+                "circular component dependency: " + " -> ".join(cycle))
+        missing = self.missing()
+        if missing:
+            detail = ", ".join(f"{name} -> {dep}" for name, dep in missing)
+            raise ComponentMissingError(
+                f"required component not found: {detail}")
+
+    def reachable(self, roots) -> set:
+        """
+        计算从 roots 出发可以到达的所有组件（传递闭包）
+        """
+        result = set()
+        stack = [i for i in roots if i in self.requires]
+        while stack:
+            name = stack.pop()
+            if name in result:
+                continue
+            result.add(name)
+            stack.extend(i for i in self.requires[name] if i in self.requires)
+        return result
+
+    def topo_order(self, names=None) -> list:
+        """
+        拓扑排序，被依赖的组件排在前面，同层级保持原有顺序
+
+        :param names: 参与排序的组件，默认为全部
+        """
+        if names is None:
+            names = list(self.requires)
+        selected = set(names)
+        order = []
+        done = set()
+        for start in names:
+            if start in done:
+                continue
+            done.add(start)
+            stack = [(start, iter(self.requires[start]))]
+            while stack:
+                name, deps = stack[-1]
+                dep = next(deps, None)
+                if dep is None:
+                    order.append(name)
+                    stack.pop()
+                elif dep in selected and dep not in done:
+                    done.add(dep)
+                    stack.append((dep, iter(self.requires[dep])))
+        return order
@@ -4,67 +4,190 @@ import os
 import json
 import shutil
 import logging
+import subprocess
 from pathlib import Path
+from contextlib import contextmanager
 import platform
 
+from .loader import load_script
+from . import profile
+
 ENTER_SCRIPT = "xf_project.py"
 COLLECT_SCRIPT = "xf_collect.py"
+BUILD_JOBS = "XF_BUILD_JOBS"
 
 system = platform.system()
 if system == "Windows":
     if "PSModulePath" in os.environ:
-        EXPORT_SCRIPT = "export.ps1"
+        EXPORT_SCRIPT_NAME = "export.ps1"
     elif "PROMPT" in os.environ:
-        EXPORT_SCRIPT = "export.bat"
+        EXPORT_SCRIPT_NAME = "export.bat"
     else:
         raise Exception("当前在windows的不明环境中，无法导出")
 elif system == "Linux":
-    EXPORT_SCRIPT = "export.sh"
+    EXPORT_SCRIPT_NAME = "export.sh"
 else:
     raise Exception(f"未知操作系统: {system}")
 
 
-try:
-    XF_ROOT = Path(os.environ.get("XF_ROOT")).resolve()
-    XF_TARGET = os.environ.get("XF_TARGET")
-    XF_TARGET_PATH = Path(os.environ.get("XF_TARGET_PATH")).resolve()
-    EXPORT_SCRIPT = XF_ROOT / EXPORT_SCRIPT
-except TypeError:
-    raise Exception(f"环境变量未设置, 请检查是否调用 {EXPORT_SCRIPT} 脚本")
+class BuildContext:
+    """
+    一次编译所需的路径：xf 根目录、目标、工程以及由它们推导出的路径。
+    属性名与本模块的常量一致，同一个进程可以依次为多个工程或目标编译。
+
+    :param xf_root: XF_ROOT 路径
+    :param xf_target: 目标名称
+    :param xf_target_path: 目标的路径，位于 XF_ROOT/boards 下
+    :param xf_project_path: 工程路径
+    :param xf_project: 工程名称，默认为工程文件夹的名称
+    :param build_path: 工程的编译产物路径，默认为工程下的 build 文件夹
+    """
+
+    def __init__(self, xf_root, xf_target: str, xf_target_path,
+                 xf_project_path=".", xf_project: str = None,
+                 build_path=None) -> None:
+        self.XF_ROOT = Path(xf_root).resolve()
+        self.XF_TARGET = xf_target
+        self.XF_TARGET_PATH = Path(xf_target_path).resolve()
+        self.EXPORT_SCRIPT = self.XF_ROOT / EXPORT_SCRIPT_NAME
+
+        self.XF_PROJECT_PATH = Path(xf_project_path).resolve()
+        self.XF_PROJECT = xf_project or self.XF_PROJECT_PATH.name
+
+        if build_path is None:
+            build_path = self.XF_PROJECT_PATH / "build"
+        self.PROJECT_BUILD_PATH = Path(build_path).resolve()
+        self.PROJECT_CONFIG_PATH = self.PROJECT_BUILD_PATH / "config.in"
+        self.PROJECT_BUILD_INFO = self.PROJECT_BUILD_PATH / "build_info.json"
+        self.PROJECT_BUILD_ENV = self.PROJECT_BUILD_PATH / "build_environ.json"
+        self.PROJECT_COMPONENTS = self.XF_PROJECT_PATH / "components"
+
+        self.ROOT_BUILD_PATH = self.XF_ROOT / "build"
+        self.ROOT_PROJECT_INFO = self.ROOT_BUILD_PATH / "project_info.json"
 
+        self.ROOT_BOARDS = self.XF_ROOT / "boards"
+        self.ROOT_COMPONENTS = self.XF_ROOT / "components"
+        self.RELATIVE_TARGET = self.XF_TARGET_PATH.relative_to(
+            self.ROOT_BOARDS)
+        self.ROOT_PORT = self.XF_ROOT / "ports" / self.RELATIVE_TARGET
 
-XF_PROJECT_PATH = Path(os.environ.get("XF_PROJECT_PATH", Path("."))).resolve()
-os.environ["XF_PROJECT_PATH"] = XF_PROJECT_PATH.as_posix()
-XF_PROJECT = os.environ.get("XF_PROJECT", XF_PROJECT_PATH.name)
-os.environ["XF_PROJECT"] = XF_PROJECT
+        self.ROOT_PLUGIN = self.XF_ROOT / "plugins" / self.XF_TARGET
 
-PROJECT_BUILD_PATH = XF_PROJECT_PATH / "build"
-PROJECT_CONFIG_PATH = PROJECT_BUILD_PATH / "config.in"
-PROJECT_BUILD_INFO = PROJECT_BUILD_PATH / "build_info.json"
-PROJECT_BUILD_ENV = PROJECT_BUILD_PATH / "build_environ.json"
-PROJECT_COMPONENTS = XF_PROJECT_PATH / "components"
+        self.ROOT_TEMPLATE_PATH = self.XF_ROOT / "examples" / \
+            "get_started" / "template_project"
 
-ROOT_BUILD_PATH = XF_ROOT / "build"
-ROOT_PROJECT_INFO = ROOT_BUILD_PATH / "project_info.json"
+    @classmethod
+    def from_environ(cls, environ=None) -> "BuildContext":
+        """
+        根据 export 脚本设置的环境变量创建上下文
+        """
+        if environ is None:
+            environ = os.environ
+        try:
+            return cls(environ.get("XF_ROOT"),
+                       environ.get("XF_TARGET"),
+                       environ.get("XF_TARGET_PATH"),
+                       environ.get("XF_PROJECT_PATH", "."),
+                       environ.get("XF_PROJECT"))
+        except TypeError:
+            raise Exception(
+                f"环境变量未设置, 请检查是否调用 {EXPORT_SCRIPT_NAME} 脚本")
 
-ROOT_BOARDS = XF_ROOT / "boards"
-ROOT_COMPONENTS = XF_ROOT / "components"
-RELATIVE_TARGET = XF_TARGET_PATH.relative_to(XF_ROOT/"boards")
-ROOT_PORT = XF_ROOT / "ports" / RELATIVE_TARGET
+    def environ(self) -> dict:
+        """
+        该上下文对应的环境变量，用于启动子进程
+        """
+        environ = dict(os.environ)
+        environ["XF_ROOT"] = self.XF_ROOT.as_posix()
+        environ["XF_TARGET"] = self.XF_TARGET
+        environ["XF_TARGET_PATH"] = self.XF_TARGET_PATH.as_posix()
+        environ["XF_PROJECT_PATH"] = self.XF_PROJECT_PATH.as_posix()
+        environ["XF_PROJECT"] = self.XF_PROJECT
+        return environ
 
-ROOT_PLUGIN = XF_ROOT / "plugins" / XF_TARGET
 
-ROOT_TEMPLATE_PATH = XF_ROOT / "examples" / "get_started" / "template_project"
+# 与之前的用法兼容的常量，例如 env.XF_ROOT，访问时从默认上下文读取
+CONTEXT_NAMES = (
+    "XF_ROOT", "XF_TARGET", "XF_TARGET_PATH", "EXPORT_SCRIPT",
+    "XF_PROJECT_PATH", "XF_PROJECT",
+    "PROJECT_BUILD_PATH", "PROJECT_CONFIG_PATH", "PROJECT_BUILD_INFO",
+    "PROJECT_BUILD_ENV", "PROJECT_COMPONENTS",
+    "ROOT_BUILD_PATH", "ROOT_PROJECT_INFO",
+    "ROOT_BOARDS", "ROOT_COMPONENTS", "RELATIVE_TARGET", "ROOT_PORT",
+    "ROOT_PLUGIN", "ROOT_TEMPLATE_PATH",
+)
 
+# 由环境变量创建的默认上下文，第一次使用时才创建，
+# 没有设置环境变量时也可以导入本模块并使用 use_context 指定上下文
+_default_context = None
+# 当前正在编译的上下文，为 None 时使用默认上下文
+_context = None
 
-def clean_project_build() -> None:
-    shutil.rmtree(PROJECT_BUILD_PATH, ignore_errors=True)
-    PROJECT_BUILD_PATH.mkdir()
 
+def default_context() -> BuildContext:
+    """
+    获取由环境变量创建的默认上下文
+    """
+    global _default_context
+    if _default_context is None:
+        ctx = BuildContext.from_environ()
+        os.environ["XF_PROJECT_PATH"] = ctx.XF_PROJECT_PATH.as_posix()
+        os.environ["XF_PROJECT"] = ctx.XF_PROJECT
+        _default_context = ctx
+    return _default_context
 
-def clean_root_build() -> None:
-    shutil.rmtree(ROOT_BUILD_PATH, ignore_errors=True)
-    ROOT_BUILD_PATH.mkdir()
+
+def __getattr__(name):
+    if name == "DEFAULT_CONTEXT":
+        return default_context()
+    if name in CONTEXT_NAMES:
+        return getattr(default_context(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_context() -> BuildContext:
+    """
+    获取当前正在编译的上下文
+    """
+    if _context is None:
+        return default_context()
+    return _context
+
+
+@contextmanager
+def use_context(ctx: BuildContext):
+    """
+    在 with 语句内把 ctx 设置为当前上下文，供收集脚本和插件中的 api 使用
+    """
+    global _context
+    previous = _context
+    _context = ctx
+    try:
+        yield ctx
+    finally:
+        _context = previous
+
+
+def get_build_jobs() -> int:
+    """
+    获取并行执行的进程数，由 xf build -j 设置
+    """
+    try:
+        return max(int(os.environ.get(BUILD_JOBS, "1")), 1)
+    except ValueError:
+        return 1
+
+
+def clean_project_build(ctx: BuildContext = None) -> None:
+    ctx = ctx or get_context()
+    shutil.rmtree(ctx.PROJECT_BUILD_PATH, ignore_errors=True)
+    ctx.PROJECT_BUILD_PATH.mkdir()
+
+
+def clean_root_build(ctx: BuildContext = None) -> None:
+    ctx = ctx or get_context()
+    shutil.rmtree(ctx.ROOT_BUILD_PATH, ignore_errors=True)
+    ctx.ROOT_BUILD_PATH.mkdir()
 
 
 def is_project(folder) -> bool:
@@ -76,65 +199,88 @@ def is_project(folder) -> bool:
     raise Exception("该目录不是工程文件夹")
 
 
-def check_target(is_clean=True):
+def clean_project(ctx: BuildContext) -> None:
+    """
+    在上下文对应的工程下执行 xf clean
+    """
+    subprocess.call("xf clean", shell=True, cwd=ctx.XF_PROJECT_PATH,
+                    env=ctx.environ())
+
+
+def check_target(is_clean=True, ctx: BuildContext = None):
     """
     检测目标是否改变，如果改变清除工程
     """
+    ctx = ctx or get_context()
     info = {}
-    if ROOT_PROJECT_INFO.exists():
-        with ROOT_PROJECT_INFO.open("r", encoding="utf-8") as f:
+    if ctx.ROOT_PROJECT_INFO.exists():
+        with ctx.ROOT_PROJECT_INFO.open("r", encoding="utf-8") as f:
             info = json.load(f)
-            if info.get("XF_TARGET_PATH") == XF_TARGET_PATH.as_posix():
+            if info.get("XF_TARGET_PATH") == ctx.XF_TARGET_PATH.as_posix():
                 logging.debug("目标未改变")
                 return
     else:
-        ROOT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
+        ctx.ROOT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
 
     logging.debug("目标改变，重新生成build")
     logging.debug(f"info target:{info.get('XF_TARGET_PATH')}")
-    logging.debug(f"env target:{XF_TARGET_PATH}")
-    os.system("xf clean")
-    with ROOT_PROJECT_INFO.open("w", encoding="utf-8") as f:
-        logging.debug(f"XF_TARGET_PATH:{XF_TARGET_PATH}")
-        info["XF_TARGET_PATH"] = XF_TARGET_PATH.as_posix()
+    logging.debug(f"env target:{ctx.XF_TARGET_PATH}")
+    clean_project(ctx)
+    with ctx.ROOT_PROJECT_INFO.open("w", encoding="utf-8") as f:
+        logging.debug(f"XF_TARGET_PATH:{ctx.XF_TARGET_PATH}")
+        info["XF_TARGET_PATH"] = ctx.XF_TARGET_PATH.as_posix()
         json.dump(info, f, indent=4)
 
 
-def check_project(is_clean=True):
+def check_project(is_clean=True, ctx: BuildContext = None):
     """
     检测工程是否改变，如果改变清除工程
     """
+    ctx = ctx or get_context()
     info = {}
-    if ROOT_PROJECT_INFO.exists():
-        with ROOT_PROJECT_INFO.open("r", encoding="utf-8") as f:
+    if ctx.ROOT_PROJECT_INFO.exists():
+        with ctx.ROOT_PROJECT_INFO.open("r", encoding="utf-8") as f:
             info = json.load(f)
-            if info.get("XF_PROJECT_PATH") == XF_PROJECT_PATH.as_posix():
+            if info.get("XF_PROJECT_PATH") == ctx.XF_PROJECT_PATH.as_posix():
                 logging.debug("工程未改变")
                 return
     else:
-        ROOT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
+        ctx.ROOT_BUILD_PATH.mkdir(parents=True, exist_ok=True)
     if not is_clean:
         return
     logging.debug("工程项目改变，重新生成build")
     logging.debug(f"info project:{info.get('XF_PROJECT_PATH')}")
-    logging.debug(f"env project:{XF_PROJECT_PATH}")
-    os.system("xf clean")
-    with ROOT_PROJECT_INFO.open("w", encoding="utf-8") as f:
-        logging.debug(f"XF_PROJECT_PATH:{XF_PROJECT_PATH}")
-        info["XF_PROJECT_PATH"] = XF_PROJECT_PATH.as_posix()
+    logging.debug(f"env project:{ctx.XF_PROJECT_PATH}")
+    clean_project(ctx)
+    with ctx.ROOT_PROJECT_INFO.open("w", encoding="utf-8") as f:
+        logging.debug(f"XF_PROJECT_PATH:{ctx.XF_PROJECT_PATH}")
+        info["XF_PROJECT_PATH"] = ctx.XF_PROJECT_PATH.as_posix()
         json.dump(info, f, indent=4)
 
 
-def run_build(is_clean=True) -> None:
+def run_build(is_clean=True, ctx: BuildContext = None) -> None:
     """
     执行一遍脚本产生编译信息
+
+    :param is_clean: 工程改变时是否清除工程
+    :param ctx: 编译上下文，默认为当前上下文
     """
-    check_target(is_clean)
-    check_project(is_clean)
+    ctx = ctx or get_context()
+    with profile.span("check_target"):
+        check_target(is_clean, ctx)
+    with profile.span("check_project"):
+        check_project(is_clean, ctx)
+    exec_project(ctx)
+
 
+def exec_project(ctx: BuildContext) -> None:
+    """
+    以 ctx 为当前上下文执行工程的 xf_project.py，不检查目标和工程是否改变
+    """
+    script_path = ctx.XF_PROJECT_PATH / ENTER_SCRIPT
     try:
-        with open(ENTER_SCRIPT, "r", encoding="utf-8") as f:
-            exec(f.read())
+        with use_context(ctx), profile.span(ENTER_SCRIPT):
+            exec(load_script(script_path, ctx.PROJECT_BUILD_PATH))
     except Exception as e:
         logging.error(f"预编译错误: {e}")
         raise e
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+from pathlib import Path
+
+from . import profile
+
+# 本次构建中内容真正发生改变的文件
+changed_artifacts = []
+
+
+def parse_size(value: str) -> int:
+    """
+    解析 512M、2G 这样的大小
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def write_if_changed(path, content: str) -> bool:
+    """
+    内容改变时才写入文件，避免修改时间变化导致下游的构建系统重新编译。
+    先写入临时文件再替换，其它进程不会读到写了一半的文件。
+
+    :param path: 文件路径
+    :param content: 文件内容
+    :return: 文件是否被写入
+    """
+    path = Path(path)
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with temp_path.open("w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+    changed_artifacts.append(path)
+    return True
+
+
+def dump_json(path, data, indent=4) -> bool:
+    """
+    保存成json，内容改变时才写入文件
+
+    :param path: 文件路径
+    :param data: 需要保存的数据
+    :param indent: 缩进
+    :return: 文件是否被写入
+    """
+    with profile.span(Path(path).name, "io"):
+        if indent is not None and _same_json(path, data):
+            return False
+        return write_if_changed(path, json.dumps(data, indent=indent))
+
+
+def _same_json(path, data) -> bool:
+    """
+    文件中的 json 与 data 是否相同（包括键的顺序）。
+    带缩进时 json 只能使用 python 实现的编码器，先用 C 实现的解码和编码比较，
+    内容未改变时不需要生成带缩进的文本
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return json.dumps(saved) == json.dumps(data)
+
+
+def log_changed_artifacts() -> None:
+    """
+    打印本次更新了的文件，并清空记录
+    """
+    if changed_artifacts:
+        files = ", ".join(i.name for i in changed_artifacts)
+        logging.debug(f"更新的文件: {files}")
+    else:
+        logging.debug("没有文件被更新")
+    changed_artifacts.clear()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import logging
+from pathlib import Path
+
+from .env import BuildContext, get_context
+from .cache import file_stamp
+from .fileio import dump_json
+from .depgraph import DependencyGraph, MAIN, COMPONENT_KINDS
+
+# #include "x.h" 或 #include <x.h>，不处理宏展开的 #include MACRO
+_INCLUDE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^">\r\n]+)[">]',
+                      re.MULTILINE)
+# 引用的 Kconfig 宏，例如 #ifdef CONFIG_XXX，只记录去掉前缀的宏名
+_CONFIG = re.compile(rb'\bCONFIG_(\w+)')
+
+# 索引文件路径 -> (build_environ.json 的指纹, IncludeIndex)
+_indexes = {}
+
+
+def iter_components(build_env: dict):
+    """
+    遍历 build_env 中的所有组件
+
+    :return: (组件名, 组件的 env)
+    """
+    for kind in COMPONENT_KINDS:
+        yield from build_env[kind].items()
+    if build_env["user_main"]:
+        yield MAIN, build_env["user_main"]
+
+
+class IncludeIndex:
+    """
+    源文件的头文件依赖索引
+
+    每个文件记录修改时间、大小、其中的 #include 以及引用的 CONFIG_ 宏，指纹未改变的文件不重新读取。
+    #include 按照组件以及其依赖的组件的 inc_dirs 解析：引号先在当前文件所在的文件夹查找，
+    找不到的头文件（例如编译器自带的头文件）不记录。
+    #if 等条件编译不做处理，结果是实际依赖的超集。
+    """
+
+    INDEX_NAME: str = "include_index.json"
+    VERSION: int = 2
+
+    def __init__(self, path: Path) -> None:
+        """
+        :param path: 索引文件路径
+        """
+        self.path = path
+        # 文件路径 -> [指纹, [[是否使用引号, 头文件名], ...], [宏名, ...]]
+        self.files = {}
+        # 源文件 -> [组件名, [头文件, ...]]
+        self.sources = {}
+        self.parsed = 0
+
+        if not path.exists():
+            return
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logging.debug(f"索引损坏，忽略: {path}")
+            return
+        if index.get("version") != self.VERSION:
+            return
+        self.files = index.get("files", {})
+        headers = index.get("headers", [])
+        self.sources = {src: [component, [headers[i] for i in ids]]
+                        for src, (component, ids)
+                        in index.get("sources", {}).items()}
+
+    def includes(self, path: str) -> list:
+        """
+        获取文件中的 #include，文件未改变时使用索引中的结果
+        """
+        stamp = file_stamp(path)
+        item = self.files.get(path)
+        if item is not None and item[0] == stamp:
+            return item[1]
+        result = []
+        symbols = set()
+        if stamp is not None:
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+            except OSError:
+                content = b""
+            for quote, name in _INCLUDE.findall(content):
+                result.append([quote == b'"',
+                               name.decode("utf-8", errors="replace").strip()])
+            symbols.update(i.decode("ascii") for i in _CONFIG.findall(content))
+            self.parsed += 1
+        self.files[path] = [stamp, result, sorted(symbols)]
+        return result
+
+    def stale(self) -> bool:
+        """
+        索引中记录的文件是否有修改或者被删除
+        """
+        return any(file_stamp(path) != item[0]
+                   for path, item in self.files.items())
+
+    def scan(self, build_env: dict) -> None:
+        """
+        扫描所有组件的源文件，更新依赖关系
+
+        :param build_env: build_environ.json 的内容
+        """
+        exists = {}
+        self.parsed = 0
+
+        def is_file(path: str) -> bool:
+            if path not in exists:
+                exists[path] = os.path.isfile(path)
+            return exists[path]
+
+        graph = DependencyGraph(build_env)
+        envs = dict(iter_components(build_env))
+        sources = {}
+        seen = set()
+        for name, env in envs.items():
+            # 组件自身的 inc_dirs 之后是直接或间接依赖的组件的 inc_dirs
+            reachable = graph.reachable([name])
+            inc_dirs = [Path(i).as_posix() for i in env.get("inc_dirs", [])]
+            for dep in graph.requires:
+                if dep in reachable and dep != name and dep in envs:
+                    inc_dirs.extend(Path(i).as_posix()
+                                    for i in envs[dep].get("inc_dirs", []))
+            inc_dirs = list(dict.fromkeys(inc_dirs))
+            # 同一个组件内，头文件的直接依赖只需要解析一次
+            resolved = {}
+
+            def resolve(path: str) -> list:
+                result = resolved.get(path)
+                if result is not None:
+                    return result
+                result = []
+                parent = os.path.dirname(path)
+                for quoted, header in self.includes(path):
+                    dirs = [parent] + inc_dirs if quoted else inc_dirs
+                    for i in dirs:
+                        candidate = os.path.normpath(os.path.join(i, header))
+                        if is_file(candidate):
+                            result.append(Path(candidate).as_posix())
+                            break
+                resolved[path] = result
+                return result
+
+            for src in env.get("srcs", []):
+                src = Path(src).as_posix()
+                seen.add(src)
+                headers = set()
+                stack = [src]
+                while stack:
+                    for header in resolve(stack.pop()):
+                        if header not in headers:
+                            headers.add(header)
+                            stack.append(header)
+                headers.discard(src)
+                sources[src] = [name, sorted(headers)]
+            seen.update(resolved)
+
+        self.sources = sources
+        # 不再使用的文件不保留在索引中
+        self.files = {path: item for path, item in self.files.items()
+                      if path in seen}
+        logging.debug(f"头文件依赖: {len(sources)} 个源文件, "
+                      f"重新解析 {self.parsed} 个文件")
+
+    @classmethod
+    def scan_project(cls, ctx: BuildContext = None,
+                     build_env: dict = None) -> "IncludeIndex":
+        """
+        更新工程 build 文件夹下的头文件依赖索引
+
+        :param ctx: 编译上下文，默认为当前上下文
+        :param build_env: build_environ.json 的内容，默认从文件读取
+        """
+        ctx = ctx or get_context()
+        if build_env is None:
+            with ctx.PROJECT_BUILD_ENV.open("r", encoding="utf-8") as f:
+                build_env = json.load(f)
+        path = ctx.PROJECT_BUILD_PATH / cls.INDEX_NAME
+        # 同一进程内复用已读取的索引，不需要再次读取索引文件
+        cached = _indexes.get(path.as_posix())
+        index = cached[1] if cached is not None else cls(path)
+        index.scan(build_env)
+        index.save()
+        _indexes[path.as_posix()] = (file_stamp(ctx.PROJECT_BUILD_ENV), index)
+        return index
+
+    @classmethod
+    def load_project(cls, ctx: BuildContext = None,
+                     build_env: dict = None) -> "IncludeIndex":
+        """
+        获取工程的头文件依赖索引，同一进程内复用，
+        只有 build_environ.json 或者索引中的文件改变时才重新扫描
+
+        :param ctx: 编译上下文，默认为当前上下文
+        :param build_env: build_environ.json 的内容，默认从文件读取
+        """
+        ctx = ctx or get_context()
+        cached = _indexes.get((ctx.PROJECT_BUILD_PATH / cls.INDEX_NAME)
+                              .as_posix())
+        if cached is not None and \
+                cached[0] == file_stamp(ctx.PROJECT_BUILD_ENV) and \
+                not cached[1].stale():
+            return cached[1]
+        return cls.scan_project(ctx, build_env)
+
+    def save(self) -> None:
+        headers = sorted({i for _, items in self.sources.values()
+                          for i in items})
+        ids = {header: i for i, header in enumerate(headers)}
+        index = {
+            "version": self.VERSION,
+            "files": self.files,
+            "headers": headers,
+            "sources": {src: [component, [ids[i] for i in items]]
+                        for src, (component, items) in self.sources.items()},
+        }
+        dump_json(self.path, index, indent=None)
+
+    def config_usage(self, exclude: str = None) -> dict:
+        """
+        各组件的源文件以及源文件包含的头文件中引用的宏，需要在 scan 之后调用
+
+        :param exclude: 不统计该文件夹下的文件，例如 xfconfig.h 所在的文件夹
+        :return: 组件名 -> {宏名, ...}
+        """
+        prefix = exclude.rstrip("/") + "/" if exclude else None
+        result = {}
+        for src, (component, headers) in self.sources.items():
+            symbols = result.setdefault(component, set())
+            for path in [src] + headers:
+                item = self.files.get(path)
+                if item is None or (prefix and path.startswith(prefix)):
+                    continue
+                symbols.update(item[2])
+        return result
+
+    def match(self, header: str) -> list:
+        """
+        查找索引中的头文件，可以是路径或者路径的结尾部分（例如 xfconfig.h）
+
+        :return: 匹配的头文件路径
+        """
+        headers = {i for _, items in self.sources.values() for i in items}
+        path = Path(header)
+        if path.exists():
+            resolved = path.resolve().as_posix()
+            if resolved in headers:
+                return [resolved]
+        name = os.path.normpath(header).replace(os.sep, "/")
+        if path.is_absolute():
+            return [name] if name in headers else []
+        # 去掉开头的 ../，剩下的部分按路径的结尾匹配
+        parts = name.split("/")
+        while parts and parts[0] == "..":
+            parts.pop(0)
+        if not parts or parts == ["."]:
+            return []
+        suffix = "/" + "/".join(parts)
+        return sorted(i for i in headers if i.endswith(suffix))
+
+    def dependents(self, header: str) -> dict:
+        """
+        反向查询：依赖该头文件的组件和源文件
+
+        :param header: 头文件的路径或者路径的结尾部分
+        :return: 组件名 -> [源文件, ...]
+        """
+        matched = set(self.match(header))
+        result = {}
+        for src, (component, headers) in self.sources.items():
+            if matched.intersection(headers):
+                result.setdefault(component, []).append(src)
+        return result
+
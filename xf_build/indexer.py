@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+from fnmatch import filter as fnmatch_filter
+from pathlib import Path
+
+from .fileio import dump_json
+
+# 文件夹条目的类型
+FILE = 0
+DIR = 1
+LINK_DIR = 2  # 指向文件夹的软链接，** 不会递归进入
+
+
+class SourceIndex:
+    """
+    基于 os.scandir 的文件夹索引
+
+    每个文件夹在一次构建中最多被 scandir 一次，所有 glob 规则共用同一份列表。
+    列表按文件夹的修改时间缓存，文件夹未改变时下次构建只需要 stat 一次。
+    """
+
+    INDEX_NAME: str = "source_index.json"
+    VERSION: int = 1
+
+    def __init__(self) -> None:
+        # 文件夹路径 -> [修改时间, [[名称, 类型], ...]]
+        self.listings = {}
+        # 本次构建中已经确认过的文件夹
+        self.fresh = set()
+        self.path = None
+        # 列表有更新，需要保存
+        self.dirty = False
+
+    def load(self, path: Path) -> None:
+        """
+        加载保存在磁盘上的索引，同一进程内已加载过则只开始新一轮构建。
+        内存中已有的列表（例如其它工程读取过的公共组件）会保留，
+        使用前都会比较文件夹的修改时间，不会因此读到过期的内容。
+
+        :param path: 索引文件路径
+        """
+        self.fresh = set()
+        if self.path == path:
+            return
+        self.path = path
+        # 内存中可能有索引文件中没有的列表
+        self.dirty = bool(self.listings)
+        if not path.exists():
+            return
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logging.debug(f"索引损坏，忽略: {path}")
+            return
+        if index.get("version") == self.VERSION:
+            for directory, listing in index.get("listings", {}).items():
+                self.listings.setdefault(directory, listing)
+
+    def save(self) -> None:
+        if self.path is None or not self.dirty:
+            return
+        index = {
+            "version": self.VERSION,
+            "listings": self.listings,
+        }
+        dump_json(self.path, index, indent=None)
+        self.dirty = False
+
+    def export(self, dirs) -> dict:
+        """
+        导出部分文件夹的列表，用于从子进程合并回主进程
+        """
+        return {i: self.listings[i] for i in dirs if i in self.listings}
+
+    def update(self, listings: dict) -> None:
+        for directory, listing in listings.items():
+            if self.listings.get(directory) != listing:
+                self.listings[directory] = listing
+                self.dirty = True
+        self.fresh.update(listings.keys())
+
+    def listdir(self, directory: str, visited: set = None) -> list:
+        """
+        获取文件夹下的条目
+
+        :param directory: 文件夹路径
+        :param visited: 记录读取过的文件夹
+        :return: [[名称, 类型], ...]，按名称排序，文件夹不存在时为空
+        """
+        if visited is not None:
+            visited.add(directory)
+        listing = self.listings.get(directory)
+        if directory in self.fresh and listing is not None:
+            return listing[1]
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        self.fresh.add(directory)
+        if listing is not None and listing[0] == mtime:
+            return listing[1]
+
+        entries = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_dir():
+                            kind = FILE
+                        elif entry.is_symlink():
+                            kind = LINK_DIR
+                        else:
+                            kind = DIR
+                    except OSError:
+                        kind = FILE
+                    entries.append([entry.name, kind])
+        except OSError:
+            return []
+        entries.sort()
+        self.listings[directory] = [mtime, entries]
+        self.dirty = True
+        return entries
+
+    def walk_dirs(self, directory: str, visited: set = None):
+        """
+        递归获取文件夹自身及其下的所有文件夹（不进入软链接）
+        """
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            yield current
+            subdirs = [os.path.join(current, name) for name, kind in
+                       self.listdir(current, visited) if kind == DIR]
+            stack.extend(reversed(subdirs))
+
+    def _select(self, directory: str, parts: tuple, visited: set):
+        if not parts:
+            yield directory
+            return
+        part, rest = parts[0], parts[1:]
+        if part == "**":
+            if not rest:
+                # 与 pathlib 一致，单独的 ** 只匹配文件夹
+                yield from self.walk_dirs(directory, visited)
+                return
+            for i in self.walk_dirs(directory, visited):
+                yield from self._select(i, rest, visited)
+            return
+        if part in (".", ".."):
+            yield from self._select(os.path.join(directory, part), rest,
+                                    visited)
+            return
+
+        entries = self.listdir(directory, visited)
+        if rest:
+            # 中间部分只能匹配文件夹
+            names = [name for name, kind in entries if kind != FILE]
+        else:
+            names = [name for name, _ in entries]
+        if any(c in part for c in "*?["):
+            matched = fnmatch_filter(names, part)
+        else:
+            matched = [part] if part in names else []
+        for name in matched:
+            yield from self._select(os.path.join(directory, name), rest,
+                                    visited)
+
+    def glob(self, base: Path, patterns: list, excludes: list = [],
+             visited: set = None) -> list:
+        """
+        在一个文件夹下匹配多个 glob 规则，结果去重并保持顺序
+
+        :param base: glob 的起始文件夹
+        :param patterns: glob 规则，支持 **
+        :param excludes: 排除的 glob 规则，匹配到文件夹时排除其下所有文件
+        :param visited: 记录读取过的文件夹，用于判断结果是否失效
+        :return: 匹配到的路径
+        """
+        base_str = str(base)
+
+        def match(pattern_list) -> dict:
+            result = {}
+            for pattern in pattern_list:
+                pattern = Path(pattern)
+                if pattern.is_absolute():
+                    raise NotImplementedError(
+                        f"Non-relative patterns are unsupported: {pattern}")
+                for i in self._select(base_str, pattern.parts, visited):
+                    result[i] = None
+            return result
+
+        matched = match(patterns)
+        if excludes:
+            excluded = match(excludes)
+            prefixes = tuple(i + os.sep for i in excluded)
+            matched = [i for i in matched
+                       if i not in excluded and not i.startswith(prefixes)]
+        return [Path(i) for i in matched]
+
+
+# 进程内共享的索引，watch 等长期运行的模式下可以复用
+source_index = SourceIndex()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import struct
+import marshal
+import hashlib
+import logging
+import importlib
+import importlib.util
+from pathlib import Path
+
+SCRIPT_CACHE_DIR = "script_cache"
+
+# 缓存文件头：python 字节码版本，脚本修改时间，脚本大小
+_HEADER = struct.Struct("<4sqq")
+
+# 进程内的缓存，同一进程多次构建时无需再读取缓存文件
+_codes = {}
+
+
+def load_script(path: Path, build_path: Path):
+    """
+    加载构建脚本编译后的代码对象
+
+    代码对象以 marshal 格式缓存在 build/script_cache 下，
+    以脚本路径、修改时间、大小以及 python 版本作为缓存的键。
+    编译时使用脚本的真实路径，报错时的 traceback 会指向脚本文件。
+
+    :param path: 脚本路径
+    :param build_path: 工程的 build 文件夹
+    :return: 可以直接 exec 的代码对象
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    stamp = (importlib.util.MAGIC_NUMBER, st.st_mtime_ns, st.st_size)
+
+    cached = _codes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    name = hashlib.sha1(path.as_posix().encode("utf-8")).hexdigest()
+    cache_path = build_path / SCRIPT_CACHE_DIR / f"{name}.bin"
+    code = _read_cache(cache_path, stamp)
+    if code is None:
+        with path.open("r", encoding="utf-8") as f:
+            source = f.read()
+        code = compile(source, path.as_posix(), "exec", dont_inherit=True)
+        _write_cache(cache_path, stamp, code)
+    _codes[path] = (stamp, code)
+    return code
+
+
+def _read_cache(cache_path: Path, stamp: tuple):
+    try:
+        with cache_path.open("rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size or _HEADER.unpack_from(data) != stamp:
+        return None
+    try:
+        return marshal.loads(data[_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+        logging.debug(f"脚本缓存损坏，重新编译: {cache_path}")
+        return None
+
+
+def _write_cache(cache_path: Path, stamp: tuple, code) -> None:
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写入临时文件再替换，并行收集时多个进程可能同时写入
+        temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+        with temp_path.open("wb") as f:
+            f.write(_HEADER.pack(*stamp))
+            f.write(marshal.dumps(code))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logging.debug(f"脚本缓存写入失败: {e}")
+
+
+def purge_modules(dirs) -> int:
+    """
+    从 sys.modules 中删除文件位于这些文件夹下的模块，
+    常驻进程再次构建时，收集脚本导入的模块会重新从文件加载
+
+    :param dirs: 组件和工程的文件夹
+    :return: 删除的模块数量
+    """
+    prefixes = tuple(os.path.join(os.path.realpath(i), "") for i in dirs)
+    stale = []
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if isinstance(path, str) and \
+                os.path.realpath(path).startswith(prefixes):
+            stale.append(name)
+    for name in stale:
+        del sys.modules[name]
+    importlib.invalidate_caches()
+    if stale:
+        logging.debug(f"移除已导入的模块: {', '.join(stale)}")
+    return len(stale)
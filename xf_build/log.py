@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import logging
-from rich.logging import RichHandler
 
 
 class ColoredFormatter(logging.Formatter):
@@ -23,6 +22,7 @@ class ColoredFormatter(logging.Formatter):
 
 def logging_setup(level, rich=False) -> None:
     if rich:
+        from rich.logging import RichHandler
         logging.basicConfig(
             level=level,
             format="%(message)s",
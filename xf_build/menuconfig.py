@@ -1,13 +1,106 @@
 import os
 from pathlib import Path
 from kconfiglib import Kconfig
-from menuconfig import menuconfig
 import logging
 import json
 
-from .env import XF_ROOT, ROOT_BOARDS, ROOT_PORT
-from .env import PROJECT_BUILD_INFO
-from .env import PROJECT_CONFIG_PATH
+from .env import BuildContext, get_context
+from .cache import ConfigCache, config_fingerprint
+from .fileio import write_if_changed
+from .indexer import source_index, FILE
+
+# 已经加载的配置快照，同一进程多次查询时复用
+_snapshot = None
+# 上次生成 config.in 时的组件和 XFKconfig
+_config_in = None
+
+
+class ConfigSnapshot:
+    """
+    menuconfig 取值的只读快照，收集脚本和插件通过它查询宏定义
+
+    :param values: 符号名 -> 取值
+    :param header: xfconfig.h 的内容
+    :param sources: 符号名 -> 定义该符号的 Kconfig 文件
+    :param kconfig_filenames: 解析过的所有 Kconfig 文件
+    :param env_vars: Kconfig 中引用的环境变量
+    """
+
+    # 单独的头文件所在的文件夹，位于 xfconfig.h 同级
+    SPLIT_DIR: str = "config"
+
+    def __init__(self, values: dict, header: str, sources: dict = {},
+                 kconfig_filenames: list = [], env_vars: list = []) -> None:
+        self.values = values
+        self.header = header
+        self.sources = sources
+        self.kconfig_filenames = kconfig_filenames
+        self.env_vars = env_vars
+        # 输入的指纹，由 MenuConfig.load_snapshot 计算
+        self.key = None
+
+    def get_macro(self, macro):
+        """
+        获取menuconfig产生的宏
+        """
+        return self.values.get(macro)
+
+    def write_header(self, header_path: Path, split: bool = False) -> None:
+        """
+        生成头文件，内容没有改变时不会写入，避免所有包含头文件的源文件重新编译
+
+        :param header_path: xfconfig.h 的路径
+        :param split: 为每个宏生成 config/<宏名>.h，xfconfig.h 只包含这些头文件
+        """
+        header_path.parent.mkdir(parents=True, exist_ok=True)
+        if not split:
+            write_if_changed(header_path, self.header)
+            return
+        symbols = self.write_split_headers(header_path.parent / self.SPLIT_DIR)
+        includes = "\n".join(f'#include "{self.SPLIT_DIR}/{i}.h"'
+                             for i in symbols)
+        write_if_changed(header_path,
+                         MenuConfig.HEADER_TEMPLATE.format(includes))
+
+    def split_defines(self) -> dict:
+        """
+        把 xfconfig.h 中的宏按照符号拆分
+
+        :return: 符号名 -> 该符号生成的 #define，值为 n 的符号为空字符串
+        """
+        prefix = "#define " + MenuConfig.KCONFIG_PREFIX
+        defines = {name: "" for name in self.sources}
+        for line in self.header.splitlines():
+            if not line.startswith(prefix):
+                continue
+            name = line[len(prefix):].split(" ", 1)[0]
+            # tristate 的 m 生成 CONFIG_<NAME>_MODULE
+            if name not in defines and name.endswith("_MODULE"):
+                name = name[:-len("_MODULE")]
+            if name in defines:
+                defines[name] += line + "\n"
+        return defines
+
+    def write_split_headers(self, split_dir: Path) -> list:
+        """
+        为每个符号生成单独的头文件，只写入取值改变的文件，并删除已经不存在的符号
+
+        :param split_dir: 头文件所在的文件夹
+        :return: 生成了头文件的符号
+        """
+        split_dir.mkdir(parents=True, exist_ok=True)
+        defines = self.split_defines()
+        for name, define in defines.items():
+            guard = f"__XF_CONFIG_{name}_H__"
+            if not define:
+                define = f"/* {MenuConfig.KCONFIG_PREFIX}{name} is not set */\n"
+            write_if_changed(split_dir / f"{name}.h",
+                             f"#ifndef {guard}\n#define {guard}\n\n"
+                             f"{define}\n#endif // {guard}\n")
+        for i in split_dir.glob("*.h"):
+            if i.stem not in defines:
+                i.unlink()
+        return sorted(defines)
 
 
 class MenuConfig(Kconfig):
@@ -18,6 +111,7 @@ class MenuConfig(Kconfig):
     CONFIG_NAME: str = "xfconfig"
     HEADER_DIR: str = "header_config"
     HEADER_NAME: str = "xfconfig.h"
+    USAGE_NAME: str = "config_usage.json"
     XFKCONFIG_NAME: str = "XFKconfig"
     DEFAULT_CONFIG: str = "xfconfig.defaults"
     KCONFIG_PREFIX: str = "CONFIG_"
@@ -31,10 +125,12 @@ class MenuConfig(Kconfig):
     def __init__(self,
                  config_in: Path,
                  target_path: Path,
-                 build_path: Path) -> None:
+                 build_path: Path,
+                 project_path: Path = None) -> None:
         logging.debug(f"config_in:{config_in}")
         super().__init__(str(config_in), True, True, "utf-8", False)
-        project_path = build_path / ".."
+        if project_path is None:
+            project_path = build_path / ".."
         proj_config_path = project_path / self.CONFIG_NAME
         self.header_path = build_path / self.HEADER_DIR / self.HEADER_NAME
 
@@ -56,31 +152,62 @@ class MenuConfig(Kconfig):
             logging.debug(f"load config: {target_default_config_path}")
             self.load_config(target_default_config_path.as_posix())
 
-        # 防止文件夹及文件夹没被建立
-        if not self.header_path.is_file():
-            header_dirs = self.header_path.parent
-            if not header_dirs.is_dir():
-                header_dirs.mkdir(parents=True, exist_ok=True)
-            with self.header_path.open("w", encoding="utf-8") as f:
-                f.write("")
-
-        self.write_autoconf(self.header_path.as_posix())
-        self.__add_header()
+    def header_contents(self) -> str:
+        """
+        生成 xfconfig.h 的内容
+        """
+        # 防止文件夹没被建立
+        header_dirs = self.header_path.parent
+        if not header_dirs.is_dir():
+            header_dirs.mkdir(parents=True, exist_ok=True)
 
-    def __add_header(self) -> None:
-        with open(self.header_path, "r", encoding="utf-8") as f:
+        temp_path = self.header_path.with_name(
+            f".{self.HEADER_NAME}.{os.getpid()}.autoconf")
+        self.write_autoconf(temp_path.as_posix())
+        with open(temp_path, "r", encoding="utf-8") as f:
             header_contents = f.read()
-        with open(self.header_path, "w", encoding="utf-8") as f:
-            header_contents = self.HEADER_TEMPLATE.format(header_contents)
-            f.write(header_contents)
+        os.remove(temp_path)
+        return self.HEADER_TEMPLATE.format(header_contents)
+
+    def snapshot(self) -> ConfigSnapshot:
+        """
+        保存当前的取值和头文件内容，之后不再需要 kconfiglib 的符号树
+        """
+        values = {name: sym.str_value for name, sym in self.syms.items()}
+        sources = {name: Path(sym.nodes[0].filename).resolve().as_posix()
+                   for name, sym in self.syms.items() if sym.nodes}
+        filenames = [Path(i).resolve().as_posix()
+                     for i in self.kconfig_filenames]
+        return ConfigSnapshot(values, self.header_contents(), sources,
+                              filenames, sorted(self.env_vars))
+
+    @classmethod
+    def header_file(cls, ctx: BuildContext = None) -> Path:
+        """
+        上下文对应的 xfconfig.h 路径
+        """
+        ctx = ctx or get_context()
+        return ctx.PROJECT_BUILD_PATH / cls.HEADER_DIR / cls.HEADER_NAME
+
+    @classmethod
+    def from_context(cls, ctx: BuildContext = None) -> "MenuConfig":
+        """
+        根据编译上下文加载 menuconfig
+
+        :param ctx: 编译上下文，默认为当前上下文
+        """
+        ctx = ctx or get_context()
+        return cls(ctx.PROJECT_CONFIG_PATH, ctx.XF_TARGET_PATH,
+                   ctx.PROJECT_BUILD_PATH, ctx.XF_PROJECT_PATH)
 
     def start(self) -> None:
         """
         运行menuconfig配置页面，并生成头文件
         """
+        # 配置界面依赖 curses，只在需要时导入
+        from menuconfig import menuconfig
         menuconfig(self)
-        self.write_autoconf(self.header_path)
-        self.__add_header()
+        self.snapshot().write_header(self.header_path)
 
     def get_macro(self, macro):
         """
@@ -92,82 +219,115 @@ class MenuConfig(Kconfig):
         return value.str_value
 
     @classmethod
-    def scan_kconfig(cls):
+    def load_snapshot(cls, ctx: BuildContext = None,
+                      key: str = None) -> ConfigSnapshot:
+        """
+        获取配置的只读快照，解析过的 Kconfig 文件和配置文件都没有改变时
+        复用已经解析的结果，只读的查询不会生成头文件
+
+        :param ctx: 编译上下文，默认为当前上下文
+        :param key: 已知的快照指纹，与已加载的快照相同时不再检查输入的文件
+        """
+        global _snapshot
+        ctx = ctx or get_context()
+        if _snapshot is not None:
+            if key is not None and key == _snapshot.key:
+                return _snapshot
+            if _snapshot.key == config_fingerprint(
+                    ctx, _snapshot.kconfig_filenames, _snapshot.env_vars):
+                return _snapshot
+        snapshot = cls.cached_snapshot(ctx)
+        snapshot.key = config_fingerprint(ctx, snapshot.kconfig_filenames,
+                                          snapshot.env_vars)
+        _snapshot = snapshot
+        return snapshot
+
+    @classmethod
+    def cached_snapshot(cls, ctx: BuildContext) -> ConfigSnapshot:
         """
-        扫描收集kconfig, 并生成头文件
+        从 build 下的缓存读取配置快照，Kconfig 和配置文件改变时才重新解析
         """
+        cache = ConfigCache(ctx.PROJECT_BUILD_PATH / ConfigCache.CACHE_NAME)
+        cached = cache.load(ctx)
+        if cached is not None:
+            logging.debug("menuconfig 未改变，使用缓存")
+            return ConfigSnapshot(cached["values"], cached["header"],
+                                  cached["sources"],
+                                  cached["kconfig_filenames"],
+                                  cached["env_vars"])
+        config = cls.from_context(ctx)
+        snapshot = config.snapshot()
+        cache.save(ctx, config.kconfig_filenames, config.env_vars, {
+            "values": snapshot.values,
+            "header": snapshot.header,
+            "sources": snapshot.sources,
+        })
+        return snapshot
+
+    @classmethod
+    def scan_kconfig(cls, ctx: BuildContext = None, build_info: dict = None):
+        """
+        扫描收集kconfig, 并生成 config.in，内容没有改变时不会写入
+
+        各组件文件夹的列表来自文件夹索引，按修改时间校验，
+        文件夹未改变时不需要再逐个检查 XFKconfig 是否存在
+
+        :param ctx: 编译上下文，默认为当前上下文
+        :param build_info: 各类组件的路径，默认读取 build_info.json
+        """
+        global _config_in
+        ctx = ctx or get_context()
         logging.info("scan config")
-        path: list = [
-            XF_ROOT / cls.XFKCONFIG_NAME,
-            ROOT_BOARDS / cls.XFKCONFIG_NAME,
+        if build_info is None:
+            with ctx.PROJECT_BUILD_INFO.open("r", encoding="utf-8") as f:
+                build_info = json.load(f)
+
+        # 组件较多时 pathlib 的开销明显，这里都使用 posix 格式的字符串
+        def xfkconfig(directory: str):
+            listing = source_index.listdir(directory)
+            if [cls.XFKCONFIG_NAME, FILE] in listing:
+                return f"{directory}/{cls.XFKCONFIG_NAME}"
+            return None
+
+        sources = [
+            (ctx.XF_ROOT / cls.XFKCONFIG_NAME).as_posix(),
+            (ctx.ROOT_BOARDS / cls.XFKCONFIG_NAME).as_posix(),
+            xfkconfig(ctx.ROOT_PORT.as_posix()),
         ]
-        port_xfconfig = ROOT_PORT / cls.XFKCONFIG_NAME
-        if port_xfconfig.exists():
-            path.append(port_xfconfig)
-
-        path_file: str = "\n".join([f'source "{i.as_posix()}"' for i in path])
-        path_file += "\n"
-
-        with PROJECT_BUILD_INFO.open("r", encoding="utf-8") as f:
-            build_info = json.load(f)
-            public_components = [
-                Path(i) for i in build_info["public_components"]]
-            user_main = Path(build_info["user_main"][0])
-            user_components = [Path(i)
-                               for i in build_info["user_components"]]
-            user_dirs = [Path(i)
-                         for i in build_info["user_dirs"]]
-
-        # public components 部分的处理
-        if public_components != []:
-            path_file += "menu \"public components\"\n"
-            for i in public_components:
-                public_component_xfconfig = i / cls.XFKCONFIG_NAME
-                if not public_component_xfconfig.exists():
-                    continue
-                public_component_config = "  menu \"" + i.name + "\"\n"
-                public_component_config += "    source \"" + \
-                    public_component_xfconfig.as_posix() + "\"\n"
-                public_component_config += "  endmenu\n"
-                path_file += public_component_config + "\n"
-            path_file += "endmenu\n\n"
-
-        # main 部分的处理
-        user_main_xfconfig = user_main / cls.XFKCONFIG_NAME
-        if user_main_xfconfig.exists():
-            user_main_config = "menu \"main\"\n"
-            user_main_config += "  source \"" + user_main_xfconfig.as_posix() + "\"\n"
-            user_main_config += "endmenu\n"
-            path_file += user_main_config + "\n"
-
-        # components 部分的处理
-        if user_components != []:
-            path_file += "menu \"user components\"\n"
-            for i in user_components:
-                user_component_xfconfig = i / cls.XFKCONFIG_NAME
-                if not user_component_xfconfig.exists():
-                    continue
-                user_component_config = "  menu \"" + i.name + "\"\n"
-                user_component_config += "    source \"" + \
-                    user_component_xfconfig.as_posix() + "\"\n"
-                user_component_config += "  endmenu\n"
-                path_file += user_component_config + "\n"
-            path_file += "endmenu\n\n"
-
-        if user_dirs != []:
-            # dirs 部分的处理
-            path_file += "menu \"user dirs\"\n"
-            for i in user_dirs:
-                user_dir_xfconfig = i / cls.XFKCONFIG_NAME
-                if not user_dir_xfconfig.exists():
+        menus = [(title, [(os.path.basename(i), xfkconfig(i))
+                          for i in build_info[kind]])
+                 for title, kind in (("public components", "public_components"),
+                                     ("main", "user_main"),
+                                     ("user components", "user_components"),
+                                     ("user dirs", "user_dirs"))]
+
+        # 组件和 XFKconfig 都没有改变时不需要重新生成
+        key = (ctx.PROJECT_CONFIG_PATH, repr([sources, menus]))
+        if _config_in == key and ctx.PROJECT_CONFIG_PATH.exists():
+            logging.info("scan config done")
+            return
+
+        lines = [f'source "{i}"\n' for i in sources if i]
+        for title, components in menus:
+            if title == "main":
+                # main 只有一个，不需要子菜单
+                path = components[0][1]
+                if path is not None:
+                    lines.append(f'menu "main"\n  source "{path}"\n'
+                                 'endmenu\n\n')
+                continue
+            if not components:
+                continue
+            lines.append(f'menu "{title}"\n')
+            for name, path in components:
+                if path is None:
                     continue
-                user_dir_config = "  menu \"" + i.name + "\"\n"
-                user_dir_config += "    source \"" + user_dir_xfconfig.as_posix() + "\"\n"
-                user_dir_config += "  endmenu\n"
-                path_file += user_dir_config + "\n"
-            path_file += "endmenu\n\n"
-
-        with PROJECT_CONFIG_PATH.open("w", encoding="utf-8") as f:
-            f.write(path_file)
+                lines.append(f'  menu "{name}"\n'
+                             f'    source "{path}"\n'
+                             '  endmenu\n\n')
+            lines.append("endmenu\n\n")
+
+        write_if_changed(ctx.PROJECT_CONFIG_PATH, "".join(lines))
+        _config_in = key
 
         logging.info("scan config done")
@@ -17,7 +17,9 @@ class Plugins:
         if not module_path.exists():
             return
         module_name = path.name
-        sys.path.append((path / "..").resolve().as_posix())
+        parent = (path / "..").resolve().as_posix()
+        if parent not in sys.path:
+            sys.path.append(parent)
         module: sys.ModuleType = importlib.import_module(module_name)
         logging.debug(f"module:{module}")
         if not hasattr(module, module_name):
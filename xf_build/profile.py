@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# 默认的 trace 文件名，保存在工程的 build 文件夹下
+TRACE_NAME = "profile.json"
+
+_profiler = None
+_thread_id = getattr(threading, "get_native_id", threading.get_ident)
+
+
+class _NullSpan:
+    """
+    未开启性能分析时所有 span 共用的空上下文
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """
+    记录嵌套的耗时区间，保存成 Chrome / Perfetto 可以打开的 trace json
+
+    时间使用 time.perf_counter，fork 出的子进程与主进程使用同一个时钟，
+    子进程记录的区间可以直接合并。
+    """
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.events = []
+        self.pid = os.getpid()
+
+    def now(self) -> float:
+        """
+        相对于开始时间的微秒数
+        """
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextmanager
+    def span(self, name: str, cat: str, args: dict):
+        start = self.now()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start,
+                "dur": self.now() - start,
+                # 子进程中记录的区间显示为单独的进程
+                "pid": os.getpid(),
+                "tid": _thread_id(),
+            }
+            if args:
+                event["args"] = args
+            self.events.append(event)
+
+    def trace(self) -> dict:
+        usage = peak_rss()
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid,
+                     "args": {"name": "xf build"}}]
+        return {
+            "traceEvents": metadata + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"peak_rss_kb": usage},
+        }
+
+    def slowest(self, cat: str, count: int) -> list:
+        """
+        按名称汇总某一类区间的耗时
+
+        :return: [(名称, 毫秒), ...]，耗时最多的排在前面
+        """
+        totals = {}
+        for event in self.events:
+            if event["cat"] == cat:
+                totals[event["name"]] = totals.get(event["name"], 0) + \
+                    event["dur"] / 1000
+        return sorted(totals.items(), key=lambda i: i[1], reverse=True)[:count]
+
+
+def peak_rss() -> dict:
+    """
+    当前进程和已结束的子进程的内存峰值，单位 KiB，不支持的平台返回空字典
+    """
+    try:
+        import resource
+    except ImportError:
+        return {}
+    scale = 1024 if os.uname().sysname == "Darwin" else 1
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children":
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+def enable() -> Profiler:
+    """
+    开始记录，之后的 span 都会被记录
+    """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> None:
+    global _profiler
+    _profiler = None
+
+
+def enabled() -> bool:
+    return _profiler is not None
+
+
+def span(name: str, cat: str = "build", **args):
+    """
+    记录一段代码的耗时，未开启性能分析时返回空上下文，几乎没有开销
+
+        with profile.span("scan_kconfig"):
+            ...
+
+    :param name: 区间名称，例如组件名
+    :param cat: 类别，同一类别的区间可以汇总
+    :param args: 附加在 trace 中的信息
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, cat, args)
+
+
+def mark() -> int:
+    """
+    当前已记录的区间数，配合 events_since 导出子进程中新增的区间
+    """
+    return len(_profiler.events) if _profiler is not None else 0
+
+
+def events_since(start: int) -> list:
+    return _profiler.events[start:] if _profiler is not None else []
+
+
+def merge(events: list) -> None:
+    """
+    合并子进程中记录的区间
+    """
+    if _profiler is not None:
+        _profiler.events.extend(events)
+
+
+def report(path, count: int = 10) -> None:
+    """
+    保存 trace 并打印最慢的组件和内存峰值
+    """
+    if _profiler is None:
+        return
+    from rich.console import Console
+    from rich.table import Table
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_profiler.trace(), f)
+
+    table = Table(title=f"最慢的 {count} 个组件")
+    table.add_column("组件", style="cyan")
+    table.add_column("耗时", justify="right")
+    for name, ms in _profiler.slowest("collect", count):
+        table.add_row(name, f"{ms:.1f} ms")
+    Console().print(table)
+    usage = peak_rss()
+    if usage:
+        logging.info(f"内存峰值: {usage['self'] / 1024:.1f} MiB, "
+                     f"子进程: {usage['children'] / 1024:.1f} MiB")
+    logging.info(f"trace 已保存: {path}，可以在 chrome://tracing 或 "
+                 f"https://ui.perfetto.dev 中打开")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import signal
+import collections
+import asyncio
+import logging
+
+# MAKEFLAGS 中的 jobserver 参数：--jobserver-auth=R,W、--jobserver-fds=R,W
+# 或者 --jobserver-auth=fifo:PATH
+_JOBSERVER = re.compile(r"--jobserver-(?:auth|fds)=(?:fifo:(\S+)|(\d+),(\d+))")
+
+
+class JobServer:
+    """
+    GNU make jobserver 的客户端
+
+    除了 make 默认给每个进程的隐式令牌，每个额外并行的命令需要从 jobserver 读取一个令牌，
+    结束后写回。
+    读取使用单独打开的非阻塞文件描述符，不会修改 make 的文件描述符的状态。
+
+    :param read_fd: 非阻塞的读端
+    :param write_fd: 写端
+    """
+
+    def __init__(self, read_fd: int, write_fd: int) -> None:
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+
+    @classmethod
+    def from_environ(cls):
+        """
+        根据继承的 MAKEFLAGS 连接 jobserver，没有或不可用时返回 None
+        """
+        match = _JOBSERVER.search(os.environ.get("MAKEFLAGS", ""))
+        if match is None or not hasattr(os, "O_NONBLOCK"):
+            return None
+        fifo, read_fd, write_fd = match.groups()
+        try:
+            if fifo is not None:
+                read_fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                write_fd = os.open(fifo, os.O_WRONLY)
+            else:
+                # make 只会把文件描述符传给标记了 + 的命令，需要先检查是否有效
+                os.fstat(int(write_fd))
+                write_fd = os.dup(int(write_fd))
+                read_fd = os.open(f"/proc/self/fd/{int(read_fd)}",
+                                  os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            logging.debug("jobserver 不可用，忽略 MAKEFLAGS")
+            return None
+        return cls(read_fd, write_fd)
+
+    def try_acquire(self):
+        """
+        不阻塞地读取一个令牌，没有时返回 None
+        """
+        try:
+            return os.read(self.read_fd, 1) or None
+        except BlockingIOError:
+            return None
+
+    def release(self, token: bytes) -> None:
+        os.write(self.write_fd, token)
+
+    def close(self) -> None:
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class CommandRunner:
+    """
+    使用 asyncio 子进程并行执行多条 shell 命令
+
+    :param jobs: 最大并行数
+    :param fail_fast: 有命令失败时终止其它命令
+    """
+
+    def __init__(self, jobs: int, fail_fast: bool = True) -> None:
+        self.jobs = max(jobs, 1)
+        self.fail_fast = fail_fast
+        self.jobserver = None
+        # jobserver 默认给每个进程一个令牌，第一条命令不需要读取
+        self.implicit_free = True
+        self.failed = False
+        self.processes = set()
+        self.stop = None
+
+    async def run(self, commands: list, prefixes: list) -> list:
+        self.jobserver = JobServer.from_environ()
+        self.semaphore = asyncio.Semaphore(self.jobs)
+        self.stop = asyncio.Event()
+        # 隐式的令牌和 jobserver 的令牌都通过该条件变量等待
+        self.slots = asyncio.Condition()
+        self.reading = False
+        try:
+            tasks = [asyncio.ensure_future(self.run_one(command, prefix))
+                     for command, prefix in zip(commands, prefixes)]
+            return await asyncio.gather(*tasks)
+        finally:
+            if self.jobserver is not None:
+                if self.reading:
+                    asyncio.get_running_loop().remove_reader(
+                        self.jobserver.read_fd)
+                self.jobserver.close()
+
+    async def acquire(self):
+        """
+        等待隐式的令牌或者 jobserver 的令牌，先空闲的先使用
+
+        :return: (是否为隐式的令牌, jobserver 的令牌)，停止时返回 None。
+                 没有 jobserver 时只受 jobs 限制，返回 (False, None)
+        """
+        if self.jobserver is None:
+            return False, None
+        async with self.slots:
+            while not self.stop.is_set():
+                if self.implicit_free:
+                    self.implicit_free = False
+                    return True, None
+                token = self.jobserver.try_acquire()
+                if token is not None:
+                    return False, token
+                if not self.reading:
+                    # 管道可读时唤醒所有等待的命令，之后重新注册
+                    self.reading = True
+                    asyncio.get_running_loop().add_reader(
+                        self.jobserver.read_fd, self.on_readable)
+                await self.slots.wait()
+            return None
+
+    def on_readable(self) -> None:
+        asyncio.get_running_loop().remove_reader(self.jobserver.read_fd)
+        self.reading = False
+        asyncio.ensure_future(self.notify())
+
+    async def notify(self) -> None:
+        async with self.slots:
+            self.slots.notify_all()
+
+    async def release(self, implicit: bool, token) -> None:
+        if implicit:
+            self.implicit_free = True
+            await self.notify()
+        elif token is not None:
+            self.jobserver.release(token)
+
+    async def run_one(self, command: str, prefix: str):
+        async with self.semaphore:
+            if self.failed:
+                return None
+            slot = await self.acquire()
+            if slot is None:
+                return None
+            try:
+                if self.failed:
+                    return None
+                return await self.execute(command, prefix)
+            finally:
+                await self.release(*slot)
+
+    async def execute(self, command: str, prefix: str) -> int:
+        logging.info(f"exec cmd {command}")
+        kwargs = {}
+        if os.name == "posix":
+            # 新的进程组，失败时可以终止 shell 启动的所有子进程
+            kwargs["start_new_session"] = True
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, limit=1024 * 1024, **kwargs)
+        self.processes.add(process)
+        try:
+            await asyncio.gather(
+                self.pump(process.stdout, sys.stdout, prefix),
+                self.pump(process.stderr, sys.stderr, prefix))
+            code = await process.wait()
+        finally:
+            self.processes.discard(process)
+        if code != 0 and self.fail_fast and not self.failed:
+            self.failed = True
+            self.stop.set()
+            logging.error(f"{prefix} 返回 {code}，终止其它命令")
+            self.terminate()
+            await self.notify()
+        return code
+
+    @staticmethod
+    async def pump(stream, output, prefix: str) -> None:
+        # 按块读取后自己拆分成行，超长的行不会触发 StreamReader 的长度限制
+        buffer = LineBuffer()
+        while True:
+            data = await stream.read(64 * 1024)
+            chunk = buffer.feed(data) if data else buffer.flush()
+            for line in chunk.decode("utf-8", errors="replace").splitlines():
+                output.write(f"{prefix} {line.rstrip()}\n")
+            output.flush()
+            if not data:
+                return
+
+    def terminate(self) -> None:
+        for process in self.processes:
+            try:
+                if os.name == "posix":
+                    os.killpg(process.pid, signal.SIGTERM)
+                else:
+                    process.terminate()
+            except (ProcessLookupError, PermissionError):
+                pass
+
+
+# 常见的编译器警告和错误输出
+WARNING_PATTERN = r"(?i)\b(warning|error|fatal)\b"
+# 没有行尾的输出超过该长度时直接输出
+MAX_LINE = 64 * 1024
+
+
+class LineBuffer:
+    """
+    把按块读取的输出拆分成整行，\n 和 \r 都作为行尾，
+    只用 \r 刷新的进度条也可以实时输出。
+    没有行尾的输出超过 limit 时不再等待，避免缓冲区无限增长。
+
+    :param limit: 缓冲区的上限，单位字节
+    """
+
+    def __init__(self, limit: int = MAX_LINE) -> None:
+        self.limit = limit
+        self.remain = b""
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        :return: 可以输出的部分，其余的保留到下次
+        """
+        if self.remain:
+            data = self.remain + data
+        # 结尾的 \r 可能是被拆开的 \r\n，留到下次
+        search = data[:-1] if data.endswith(b"\r") else data
+        end = max(search.rfind(b"\n"), search.rfind(b"\r")) + 1
+        if not end and len(data) >= self.limit:
+            end = len(data)
+        self.remain = data[end:]
+        return data[:end]
+
+    def flush(self) -> bytes:
+        data, self.remain = self.remain, b""
+        return data
+
+
+class OutputStream:
+    """
+    读取子进程的一个输出管道，按块读取后整行写入终端和日志文件
+
+    终端和日志文件的写入由调用者提供的锁保护，stdout 和 stderr 的行不会混在一起。
+
+    :param output: 终端输出，例如 sys.stdout，为 None 时不打印
+    :param lock: 多个输出共享的锁
+    :param log_file: 以二进制方式打开的日志文件，为 None 时不写入
+    :param max_lines: 只保留最后的行数，为 None 时保留全部
+    :param match: 只保留匹配该正则表达式的行，为 None 时不过滤
+    """
+
+    def __init__(self, output, lock, log_file=None, max_lines: int = None,
+                 match=None) -> None:
+        self.output = output
+        self.lock = lock
+        self.log_file = log_file
+        self.match = re.compile(match) if isinstance(match, str) else match
+        if max_lines is None:
+            self.lines = []
+        else:
+            self.lines = collections.deque(maxlen=max(max_lines, 0))
+        self.keep = max_lines is None or max_lines > 0
+        self.buffer = LineBuffer()
+
+    def read(self, fd: int) -> None:
+        """
+        读取到管道关闭为止
+        """
+        while True:
+            data = os.read(fd, 64 * 1024)
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+    def feed(self, data: bytes) -> None:
+        chunk = self.buffer.feed(data)
+        if chunk:
+            self.write(chunk)
+
+    def close(self) -> None:
+        remain = self.buffer.flush()
+        if remain:
+            self.write(remain + b"\n")
+
+    def write(self, chunk: bytes) -> None:
+        with self.lock:
+            if self.output is not None:
+                buffer = getattr(self.output, "buffer", None)
+                if buffer is not None:
+                    self.output.flush()
+                    buffer.write(chunk)
+                    buffer.flush()
+                else:
+                    self.output.write(chunk.decode("utf-8", errors="replace"))
+                    self.output.flush()
+            if self.log_file is not None:
+                self.log_file.write(chunk)
+        if not self.keep:
+            return
+        for line in chunk.decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if self.match is None or self.match.search(line):
+                self.lines.append(line)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import struct
+import select
+import logging
+import platform
+from pathlib import Path
+
+# 文件修改后等待一段时间，合并连续保存产生的多次修改
+DEBOUNCE: float = 0.2
+POLL_INTERVAL: float = 1.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Watcher:
+    """
+    监视文件夹下的文件修改
+
+    :param roots: [(文件夹, 是否递归), ...]
+    :param ignores: 忽略的文件夹，例如工程的 build 文件夹
+    """
+
+    def __init__(self, roots: list, ignores: list = []) -> None:
+        self.roots = [(Path(path), recursive) for path, recursive in roots
+                      if Path(path).is_dir()]
+        self.ignores = [Path(i) for i in ignores]
+
+    def is_ignored(self, path: Path) -> bool:
+        if path.name.startswith(".") or path.name == "__pycache__":
+            return True
+        return any(path == i or i in path.parents for i in self.ignores)
+
+    def iter_dirs(self):
+        """
+        获取需要监视的所有文件夹
+        """
+        for root, recursive in self.roots:
+            if not recursive:
+                yield root
+                continue
+            for path, dirs, _ in os.walk(root):
+                path = Path(path)
+                dirs[:] = [i for i in dirs if not self.is_ignored(path / i)]
+                yield path
+
+    def wait(self) -> list:
+        """
+        阻塞直到有文件被修改
+
+        :return: 被修改的文件
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    定时比较文件的修改时间，在不支持 inotify 的平台上使用
+    """
+
+    def __init__(self, roots: list, ignores: list = []) -> None:
+        super().__init__(roots, ignores)
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict:
+        result = {}
+        for directory in self.iter_dirs():
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if self.is_ignored(Path(entry.path)):
+                            continue
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        result[entry.path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return result
+
+    def wait(self) -> list:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            snapshot = self.scan()
+            changed = [path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)]
+            self.snapshot = snapshot
+            if changed:
+                return sorted(changed)
+
+
+class InotifyWatcher(Watcher):
+    """
+    通过 linux 的 inotify 监视文件修改
+    """
+
+    def __init__(self, roots: list, ignores: list = []) -> None:
+        import ctypes
+        import ctypes.util
+
+        super().__init__(roots, ignores)
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        for directory in self.iter_dirs():
+            self.add_watch(directory)
+
+    def add_watch(self, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(str(directory)), WATCH_MASK)
+        if wd < 0:
+            logging.debug(f"无法监视文件夹: {directory}")
+            return
+        self.wds[wd] = directory
+
+    def read_events(self, timeout) -> list:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，无法得知具体修改了哪些文件
+                changed.extend(root for root, _ in self.roots)
+                continue
+            directory = self.wds.get(wd)
+            if directory is None:
+                continue
+            path = directory / os.fsdecode(name) if name else directory
+            if self.is_ignored(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # 新建的文件夹也需要监视
+                for root, dirs, _ in os.walk(path):
+                    root = Path(root)
+                    dirs[:] = [i for i in dirs
+                               if not self.is_ignored(root / i)]
+                    self.add_watch(root)
+            changed.append(path)
+        return changed
+
+    def wait(self) -> list:
+        while True:
+            changed = self.read_events(None)
+            while True:
+                more = self.read_events(DEBOUNCE)
+                if not more:
+                    break
+                changed.extend(more)
+            if changed:
+                return sorted(set(i.as_posix() for i in changed))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_watcher(roots: list, ignores: list = []) -> Watcher:
+    """
+    创建文件监视器，linux 下使用 inotify，其它平台或者 inotify 不可用时轮询
+    """
+    if platform.system() == "Linux":
+        try:
+            return InotifyWatcher(roots, ignores)
+        except (OSError, AttributeError) as e:
+            logging.debug(f"inotify 不可用，使用轮询: {e}")
+    return PollingWatcher(roots, ignores)